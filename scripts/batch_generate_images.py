@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Batch-generate the book's illustrations from manuscript/ch*_prompts.md.
+
+Every ``> **Prompt:**`` block followed by a ``📁 **推荐保存文件名**: `name.png``
+line becomes one job. Jobs run concurrently with asyncio under a configurable
+limit, each with retry and exponential backoff. Targets that already exist in
+manuscript/images are skipped unless --force is given or their prompt or
+generation parameters changed since they were recorded in
+manuscript/images/manifest.json (see image_manifest.py).
+
+Providers:
+- gemini: image_providers.GeminiProvider (GOOGLE_API_KEY / GOOGLE_GEMINI_BASE_URL)
+- openai: image_providers.OpenAIProvider (OPENAI_API_KEY / OPENAI_BASE_URL)
+- stub:   offline placeholder images with simulated latency and failures
+
+Point either real provider at mock_image_server.py to benchmark concurrency,
+retries and rate limiting without network access.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import image_manifest
+import image_providers
+import model_catalog
+
+ROOT = Path(__file__).resolve().parent.parent
+MANUSCRIPT_DIR = ROOT / "manuscript"
+IMAGES_DIR = MANUSCRIPT_DIR / "images"
+
+PROMPT_START = "> **Prompt:**"
+FILENAME_RE = re.compile(r"推荐保存文件名\**\s*[:：]\s*`([^`]+)`")
+PROMPTS_FILE_RE = re.compile(r"ch(\d+)_prompts\.md$")
+
+
+class PromptJob(NamedTuple):
+    chapter: int
+    title: str
+    prompt: str
+    filename: str
+
+
+def parse_prompts_file(path: Path) -> list[PromptJob]:
+    """Extract (title, prompt, filename) jobs from one chN_prompts.md file."""
+    match = PROMPTS_FILE_RE.search(path.name)
+    chapter = int(match.group(1)) if match else 0
+    jobs: list[PromptJob] = []
+    title = ""
+    collecting: list[str] | None = None
+
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if line.startswith("## "):
+            title = line[3:].strip()
+        if collecting is None:
+            if line.strip() == PROMPT_START:
+                collecting = []
+            continue
+
+        name = FILENAME_RE.search(line)
+        if name:
+            prompt = "\n".join(collecting).strip()
+            if prompt:
+                jobs.append(PromptJob(chapter, title, prompt, name.group(1).strip()))
+            collecting = None
+        elif line.startswith(">"):
+            collecting.append(line[2:] if line.startswith("> ") else line[1:])
+        elif line.strip():
+            # The quote block ended without a filename line; drop the prompt.
+            collecting = None
+    return jobs
+
+
+def load_jobs(manuscript_dir: Path = MANUSCRIPT_DIR, chapters: set[int] | None = None) -> list[PromptJob]:
+    files = [path for path in manuscript_dir.glob("ch*_prompts.md") if PROMPTS_FILE_RE.search(path.name)]
+    files.sort(key=lambda path: int(PROMPTS_FILE_RE.search(path.name).group(1)))
+    jobs: list[PromptJob] = []
+    for path in files:
+        jobs.extend(job for job in parse_prompts_file(path) if chapters is None or job.chapter in chapters)
+    return jobs
+
+
+class RemoteProvider:
+    """Async wrapper around an image_providers backend (gemini or openai)."""
+
+    def __init__(self, name: str, model: str | None = None, size: str | None = None):
+        self.backend = image_providers.get_provider(name)
+        self.model = model or self.backend.default_model
+        self.size = size if name == "openai" else None
+
+    def params(self) -> dict:
+        return {"provider": self.backend.name, "model": self.model, "size": self.size}
+
+    async def generate(self, prompt: str, output_file: Path) -> None:
+        await asyncio.to_thread(self.backend.generate, prompt, str(output_file), self.model, self.size)
+
+
+class StubProvider:
+    """Offline provider: sleeps for a random latency and fails at the given rate."""
+
+    def __init__(self, latency: float = 0.2, failure_rate: float = 0.0, seed: int | None = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def params(self) -> dict:
+        return {"provider": "stub", "model": None, "size": None}
+
+    async def generate(self, prompt: str, output_file: Path) -> None:
+        await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.random.random() < self.failure_rate:
+            raise image_providers.ProviderError("stub provider: simulated failure")
+        from PIL import Image
+
+        Image.new("RGB", (64, 36), color=(254, 252, 232)).save(output_file)
+
+
+async def run_job(
+    job: PromptJob,
+    provider,
+    output_dir: Path,
+    semaphore: asyncio.Semaphore,
+    retries: int = 3,
+    backoff: float = 2.0,
+) -> bool:
+    target = output_dir / job.filename
+    # Write to a temporary file in the same directory and rename, so a failed
+    # or interrupted attempt never leaves a truncated image behind.
+    tmp_file = target.with_name(f".{target.stem}.{os.getpid()}.tmp{target.suffix}")
+    for attempt in range(1, retries + 2):
+        async with semaphore:
+            try:
+                await provider.generate(job.prompt, tmp_file)
+                os.replace(tmp_file, target)
+                print(f"[ok] {job.filename}")
+                return True
+            except Exception as e:
+                tmp_file.unlink(missing_ok=True)
+                print(f"[attempt {attempt}] {job.filename}: {e}")
+        if attempt <= retries:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+    print(f"[failed] {job.filename}")
+    return False
+
+
+async def run_batch(
+    jobs: list[PromptJob],
+    provider,
+    output_dir: Path = IMAGES_DIR,
+    concurrency: int = 4,
+    retries: int = 3,
+    backoff: float = 2.0,
+    force: bool = False,
+    manifest_file: Path | None = None,
+) -> dict[str, list[str]]:
+    """Run all jobs; return {"generated": [...], "skipped": [...], "failed": [...]} filenames.
+
+    manifest_file defaults to manifest.json inside output_dir.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_file = manifest_file or output_dir / image_manifest.MANIFEST_FILE.name
+    manifest = image_manifest.load_manifest(manifest_file)
+    params = provider.params()
+
+    summary: dict[str, list[str]] = {"generated": [], "skipped": [], "failed": []}
+    pending: list[PromptJob] = []
+    for job in jobs:
+        if not force and image_manifest.is_current(manifest, job, params, output_dir):
+            summary["skipped"].append(job.filename)
+        else:
+            pending.append(job)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_and_record(job: PromptJob) -> bool:
+        ok = await run_job(job, provider, output_dir, semaphore, retries, backoff)
+        if ok:
+            image_manifest.record(manifest, job, params, output_dir / job.filename)
+            image_manifest.save_manifest(manifest, manifest_file)
+        return ok
+
+    results = await asyncio.gather(*(run_and_record(job) for job in pending))
+    for job, ok in zip(pending, results):
+        summary["generated" if ok else "failed"].append(job.filename)
+    return summary
+
+
+def make_provider(args):
+    if args.provider == "stub":
+        return StubProvider(args.stub_latency, args.stub_failure_rate)
+    return RemoteProvider(args.provider, args.model, args.size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch-generate images from manuscript/ch*_prompts.md")
+    parser.add_argument("--provider", "-p", choices=["gemini", "openai", "stub"], default="gemini")
+    parser.add_argument("--model", "-m", help="Model name (provider default if omitted)")
+    parser.add_argument("--size", "-s", default="1024x1024", help="Image size for the openai provider")
+    parser.add_argument("--chapter", "-c", type=int, action="append", help="Only this chapter (repeatable)")
+    parser.add_argument("--output-dir", "-o", type=Path, default=IMAGES_DIR, help="Where images are saved")
+    parser.add_argument("--concurrency", "-j", type=int, default=4, help="Maximum concurrent requests")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per image after the first attempt")
+    parser.add_argument("--backoff", type=float, default=2.0, help="Base backoff in seconds (doubles per retry)")
+    parser.add_argument("--force", action="store_true", help="Regenerate images even if they are current")
+    parser.add_argument("--dry-run", action="store_true", help="List the jobs without generating anything")
+    parser.add_argument("--no-model-check", action="store_true", help="Skip validating --model against the model catalog")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Mean latency of the stub provider")
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0, help="Failure rate of the stub provider")
+    args = parser.parse_args()
+
+    jobs = load_jobs(chapters=set(args.chapter) if args.chapter else None)
+    if args.dry_run:
+        for job in jobs:
+            state = "exists" if (args.output_dir / job.filename).exists() else "missing"
+            print(f"ch{job.chapter:<3} {state:<8} {job.filename}  ({job.title})")
+        print(f"{len(jobs)} prompts")
+    else:
+        provider = make_provider(args)
+        if isinstance(provider, RemoteProvider) and not args.no_model_check:
+            try:
+                model_catalog.validate_model(provider.backend, provider.model)
+            except image_providers.ProviderError as e:
+                raise SystemExit(f"Error: {e}")
+        started = time.perf_counter()
+        summary = asyncio.run(
+            run_batch(jobs, provider, args.output_dir, args.concurrency, args.retries, args.backoff, args.force)
+        )
+        print(
+            f"Done in {time.perf_counter() - started:.1f}s: "
+            f"{len(summary['generated'])} generated, {len(summary['skipped'])} skipped, {len(summary['failed'])} failed"
+        )
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""为导出 Word 生成缩小、重新压缩过的配图派生文件。
+
+原图（manuscript/images，约 2752px 宽的 PNG）直接嵌入会让 docx 体积巨大。
+这里按版心宽度 5.5 英寸生成两种派生图：
+
+- print：300 DPI（1650px 宽），高质量 JPEG，用于印刷稿
+- screen：150 DPI（825px 宽），JPEG，用于屏幕阅读/传阅
+
+带透明通道的图片改存为优化过的 PNG，以保留透明区域。
+
+派生图按「原图内容哈希 + 派生参数」命名，存放于 .cache/images/<profile>/，
+原图字节不变就不会重新生成。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+MANUSCRIPT_DIR = ROOT / "manuscript"
+IMAGES_DIR = MANUSCRIPT_DIR / "images"
+CACHE_DIR = ROOT / ".cache" / "images"
+
+# 版心宽度（英寸），与 export_to_word 中 add_picture 的宽度一致。
+LAYOUT_WIDTH_INCHES = 5.5
+
+# 派生逻辑版本号：修改 derive_image 的输出时递增，使旧派生图失效。
+ASSET_VERSION = "1"
+
+PROFILES = {
+    "print": {"dpi": 300, "quality": 92},
+    "screen": {"dpi": 150, "quality": 80},
+}
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+IMAGE_LINK_RE = re.compile(r"(!\[[^\]]*\]\()([^)\s]+)(\))")
+
+
+def max_width(profile: str) -> int:
+    return int(LAYOUT_WIDTH_INCHES * PROFILES[profile]["dpi"])
+
+
+def asset_key(source_bytes: bytes, profile: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(source_bytes)
+    digest.update(repr((ASSET_VERSION, LAYOUT_WIDTH_INCHES, profile, sorted(PROFILES[profile].items()))).encode("utf-8"))
+    return digest.hexdigest()[:24]
+
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def cached_asset(key: str, profile: str) -> Path | None:
+    for ext in (".jpg", ".png"):
+        path = CACHE_DIR / profile / f"{key}{ext}"
+        if path.exists():
+            return path
+    return None
+
+
+def derive_image(source: Path, profile: str = "print") -> Path:
+    """返回 source 的派生图路径；缓存中没有时才解码、缩放、压缩。"""
+    settings = PROFILES[profile]
+    key = asset_key(source.read_bytes(), profile)
+    cached = cached_asset(key, profile)
+    if cached is not None:
+        return cached
+
+    with Image.open(source) as img:
+        img.load()
+        width = max_width(profile)
+        if img.width > width:
+            height = round(img.height * width / img.width)
+            img = img.resize((width, height), Image.LANCZOS)
+
+        dpi = (settings["dpi"], settings["dpi"])
+        if has_alpha(img):
+            fmt, ext = "PNG", ".png"
+            save_kwargs = {"dpi": dpi, "optimize": True}
+        else:
+            fmt, ext = "JPEG", ".jpg"
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            save_kwargs = {"dpi": dpi, "quality": settings["quality"], "optimize": True, "progressive": True}
+
+        target = CACHE_DIR / profile / f"{key}{ext}"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        try:
+            img.save(tmp_path, format=fmt, **save_kwargs)
+            os.replace(tmp_path, target)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return target
+
+
+def _derive_job(job: tuple[Path, str]) -> Path:
+    return derive_image(*job)
+
+
+def build_assets(sources: list[Path], profile: str = "print", jobs: int = 0) -> dict[Path, Path]:
+    """并行生成派生图，返回 {原图绝对路径: 派生图路径}。jobs 为 0 时使用全部 CPU 核心。"""
+    sources = [path.resolve() for path in sources]
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    work = [(path, profile) for path in sources]
+    if jobs <= 1 or len(work) <= 1:
+        results = [_derive_job(job) for job in work]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+            results = list(pool.map(_derive_job, work))
+    return dict(zip(sources, results))
+
+
+def rewrite_image_links(md_text: str, base_dir: Path, profile: str = "print", jobs: int = 0) -> str:
+    """把 Markdown 中指向本地图片的链接替换为派生图的绝对路径；找不到的图片保持原样。"""
+    return rewrite_image_links_many([md_text], base_dir, profile, jobs)[0]
+
+
+def rewrite_image_links_many(md_texts: list[str], base_dir: Path, profile: str = "print", jobs: int = 0) -> list[str]:
+    """同 rewrite_image_links，但对多段文本只生成一次派生图。"""
+    sources: dict[str, Path] = {}
+    for md_text in md_texts:
+        for match in IMAGE_LINK_RE.finditer(md_text):
+            target = match.group(2)
+            path = base_dir / target
+            if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+                sources[target] = path.resolve()
+    if not sources:
+        return list(md_texts)
+
+    assets = build_assets(sorted(set(sources.values())), profile, jobs)
+
+    def replace(match: re.Match) -> str:
+        source = sources.get(match.group(2))
+        if source is None:
+            return match.group(0)
+        return f"{match.group(1)}{assets[source].as_posix()}{match.group(3)}"
+
+    return [IMAGE_LINK_RE.sub(replace, md_text) for md_text in md_texts]
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="生成配图的印刷/屏幕派生文件")
+    parser.add_argument("--profile", "-p", choices=sorted(PROFILES), action="append", help="派生类型，可重复；默认全部")
+    parser.add_argument("--jobs", "-j", type=int, default=0, help="并行进程数，0 表示使用全部 CPU 核心")
+    args = parser.parse_args(argv)
+
+    sources = sorted(path for path in IMAGES_DIR.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+    for profile in args.profile or sorted(PROFILES):
+        assets = build_assets(sources, profile, args.jobs)
+        original = sum(path.stat().st_size for path in assets)
+        derived = sum(path.stat().st_size for path in assets.values())
+        print(f"[{profile}] {len(assets)} 张图片：{original / 1e6:.1f} MB → {derived / 1e6:.1f} MB（{CACHE_DIR / profile}）")
+
+
+if __name__ == "__main__":
+    main()
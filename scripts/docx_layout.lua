@@ -0,0 +1,78 @@
+-- 导出全书 Word 时的 pandoc 版式过滤器（由 export_full_book_docx.py 通过 --lua-filter 调用）。
+--
+-- 单独成段的图片改写为：居中的图片段落（Figure 样式）+ 居中图题（Caption 样式）
+-- + 一个段前段后为 0 的空段落。图题直接取自该图片自身的说明文字，图片缺失时保持
+-- pandoc 默认输出。标题的分页属性由 reference.docx 中的样式提供；表格行的分页属性
+-- 由 export_full_book_docx.py 在 pandoc 输出后逐行写入。
+
+local SPACER = pandoc.RawBlock("openxml", '<w:p><w:pPr><w:spacing w:before="0" w:after="0"/></w:pPr></w:p>')
+
+local function file_exists(path)
+  local f = io.open(path, "rb")
+  if f then
+    f:close()
+    return true
+  end
+  return false
+end
+
+local function image_exists(src)
+  if file_exists(src) then
+    return true
+  end
+  for _, dir in ipairs(PANDOC_STATE.resource_path or {}) do
+    if file_exists(dir .. "/" .. src) then
+      return true
+    end
+  end
+  return false
+end
+
+local function stem(src)
+  local name = src:match("([^/\\]+)$") or src
+  name = name:gsub("%.[^.]*$", "")
+  return (name:gsub("_", " "))
+end
+
+local function styled(style, inlines)
+  return pandoc.Div({ pandoc.Para(inlines) }, pandoc.Attr("", {}, { { "custom-style", style } }))
+end
+
+local function figure_blocks(img, caption)
+  if not image_exists(img.src) then
+    return nil
+  end
+  if pandoc.utils.stringify(caption) == "" then
+    caption = { pandoc.Str(stem(img.src)) }
+  end
+  local image = pandoc.Image(caption, img.src, "", img.attr)
+  return { styled("Figure", { image }), styled("Caption", caption), SPACER }
+end
+
+local function single_image(block)
+  if (block.t == "Para" or block.t == "Plain") and #block.content == 1 and block.content[1].t == "Image" then
+    return block.content[1]
+  end
+  return nil
+end
+
+-- pandoc 3：带说明文字的单独图片会被解析为 Figure。
+function Figure(fig)
+  if #fig.content ~= 1 then
+    return nil
+  end
+  local img = single_image(fig.content[1])
+  if img == nil then
+    return nil
+  end
+  return figure_blocks(img, pandoc.utils.blocks_to_inlines(fig.caption.long))
+end
+
+-- pandoc 2 的隐式图片，以及没有说明文字的单图段落。
+function Para(para)
+  local img = single_image(para)
+  if img == nil then
+    return nil
+  end
+  return figure_blocks(img, img.caption)
+end
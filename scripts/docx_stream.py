@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""不经 python-docx 对象模型、边生成边写入的 docx 包。
+
+正文以 WordprocessingML 字符串的形式直接写进 zip 中的 word/document.xml，
+写过的内容不在内存里保留；样式、编号、主题等部件取自一个只含样式、没有正文
+的模板 Document（与 python-docx 后端用的完全相同），连同图片、超链接关系与
+[Content_Types].xml 在 close() 时一次写入。内存占用只与图片与链接的个数有关，
+与正文长度无关。
+
+图片只记录路径，close() 时直接从磁盘拷入 zip（不再压缩）。
+
+可用作上下文管理器：正常退出时 close()，出错时 abort() 删除未写完的临时文件。
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import posixpath
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from docx.image.image import Image as DocxImage
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.styles import styleId_from_name
+from lxml import etree
+
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+CONTENT_TYPES = "[Content_Types].xml"
+# 攒够这么多字节再交给 zip 压缩
+FLUSH_SIZE = 256 * 1024
+# XML 1.0 不允许的控制字符（\t \n \r 之外的 C0 控制字符）
+INVALID_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+LINE_BREAK_RE = re.compile(r"[\n\r]")
+
+DRAWING_XML = (
+    '<w:drawing><wp:inline xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"'
+    ' xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{id}" name="Picture {id}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name={name}/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"/></pic:spPr></pic:pic></a:graphicData></a:graphic>'
+    '</wp:inline></w:drawing>'
+)
+
+
+def check_xml_text(text: str) -> str:
+    """含 XML 不允许的控制字符时报错，与 python-docx 后端对同样输入的行为一致。"""
+    if INVALID_XML_RE.search(text):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    return text
+
+
+def quote_attr(value: str) -> str:
+    return '"' + escape(check_xml_text(value), {'"': "&quot;"}) + '"'
+
+
+def text_xml(text: str) -> str:
+    """run 内的文字：与 python-docx 的 run.text 一样，\\n、\\r 转为 w:br，\\t 转为 w:tab。"""
+    parts = []
+    for i, line in enumerate(LINE_BREAK_RE.split(text)):
+        if i:
+            parts.append("<w:br/>")
+        for j, chunk in enumerate(line.split("\t")):
+            if j:
+                parts.append("<w:tab/>")
+            if chunk:
+                space = ' xml:space="preserve"' if chunk.strip() != chunk else ""
+                parts.append(f"<w:t{space}>{escape(check_xml_text(chunk))}</w:t>")
+    return "".join(parts)
+
+
+def run_xml(text: str, style: str | None = None) -> str:
+    """一个 run；style 为字符样式名。"""
+    rpr = f'<w:rPr><w:rStyle w:val="{styleId_from_name(style)}"/></w:rPr>' if style else ""
+    return f"<w:r>{rpr}{text_xml(text)}</w:r>"
+
+
+def paragraph_xml(content: str = "", style: str | None = None, align: str | None = None) -> str:
+    """一个段落；style 为段落样式名，align 为 w:jc 的取值（如 center）。"""
+    ppr = ""
+    if style:
+        ppr += f'<w:pStyle w:val="{styleId_from_name(style)}"/>'
+    if align:
+        ppr += f'<w:jc w:val="{align}"/>'
+    if ppr:
+        ppr = f"<w:pPr>{ppr}</w:pPr>"
+    if not ppr and not content:
+        return "<w:p/>"
+    return f"<w:p>{ppr}{content}</w:p>"
+
+
+class DocxStream:
+    """把正文流式写入 output_path 的 docx 包；template 为提供样式与节属性的 Document。"""
+
+    def __init__(self, output_path, template):
+        self.output_path = str(output_path)
+        buffer = io.BytesIO()
+        template.save(buffer)
+        with zipfile.ZipFile(buffer) as z:
+            self.template_parts = {name: z.read(name) for name in z.namelist()}
+
+        # 模板正文为空，document.xml 即「开头 + <w:body> + sectPr + 结尾」
+        document = self.template_parts.pop(DOCUMENT_PART).decode("utf-8")
+        body_start = document.index("<w:body>") + len("<w:body>")
+        body_end = document.index("</w:body>")
+        self.head, self.sect_pr, self.tail = document[:body_start], document[body_start:body_end], document[body_end:]
+
+        self.rels = etree.fromstring(self.template_parts.pop(DOCUMENT_RELS))
+        self.next_rel = 1 + max(int(rel.get("Id")[3:]) for rel in self.rels if rel.get("Id", "").startswith("rId"))
+        self.images: dict[str, tuple[str, str]] = {}  # 图片路径 → (rId, media 部件名)
+        self.image_sizes: dict[tuple[str, int], tuple[int, int]] = {}
+        self.hyperlinks: dict[str, str] = {}  # URL → rId
+        self.extensions: dict[str, str] = {}  # 图片扩展名 → content type
+        self.next_docpr_id = 1
+
+        self.tmp_path = os.path.join(
+            os.path.dirname(self.output_path) or ".", f".{os.path.basename(self.output_path)}.{os.getpid()}.tmp"
+        )
+        self.zip = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_DEFLATED)
+        self.stream = self.zip.open(DOCUMENT_PART, "w", force_zip64=True)
+        self.pending: list[str] = []
+        self.pending_size = 0
+        self.write(self.head)
+
+    def write(self, xml: str) -> None:
+        self.pending.append(xml)
+        self.pending_size += len(xml)
+        if self.pending_size >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        self.stream.write("".join(self.pending).encode("utf-8"))
+        self.pending = []
+        self.pending_size = 0
+
+    def add_relationship(self, rel_type: str, target: str, external: bool = False) -> str:
+        rel_id = f"rId{self.next_rel}"
+        self.next_rel += 1
+        rel = etree.SubElement(self.rels, f"{{{REL_NS}}}Relationship")
+        rel.set("Id", rel_id)
+        rel.set("Type", rel_type)
+        rel.set("Target", target)
+        if external:
+            rel.set("TargetMode", "External")
+        return rel_id
+
+    def hyperlink_rel(self, url: str) -> str:
+        """外部链接的关系 ID；同一 URL 只建一个关系。"""
+        if url not in self.hyperlinks:
+            self.hyperlinks[url] = self.add_relationship(RT.HYPERLINK, url, external=True)
+        return self.hyperlinks[url]
+
+    def drawing_xml(self, image_path, width: int) -> str:
+        """嵌入图片的 w:drawing，宽度 width（EMU），高度按图片比例；同一文件只存一份。"""
+        image_path = str(image_path)
+        key = (image_path, width)
+        if key not in self.image_sizes:
+            image = DocxImage.from_file(image_path)
+            self.image_sizes[key] = image.scaled_dimensions(width, None)
+            if image_path not in self.images:
+                part_name = f"word/media/image{len(self.images) + 1}.{image.ext}"
+                rel_id = self.add_relationship(RT.IMAGE, posixpath.relpath(part_name, "word"))
+                self.images[image_path] = (rel_id, part_name)
+                self.extensions[image.ext] = image.content_type
+        cx, cy = self.image_sizes[key]
+        doc_pr_id = self.next_docpr_id
+        self.next_docpr_id += 1
+        return DRAWING_XML.format(
+            cx=cx, cy=cy, id=doc_pr_id, name=quote_attr(os.path.basename(image_path)), rid=self.images[image_path][0]
+        )
+
+    def close(self) -> None:
+        """写入节属性、收尾正文，再写入其余部件并把包移到 output_path。"""
+        try:
+            self.write(self.sect_pr + self.tail)
+            self.flush()
+            self.stream.close()
+
+            types = etree.fromstring(self.template_parts.pop(CONTENT_TYPES))
+            known = {el.get("Extension") for el in types if el.get("Extension")}
+            for ext, content_type in sorted(self.extensions.items()):
+                if ext not in known:
+                    default = etree.Element(f"{{{CT_NS}}}Default")
+                    default.set("Extension", ext)
+                    default.set("ContentType", content_type)
+                    types.insert(0, default)
+            self.zip.writestr(CONTENT_TYPES, etree.tostring(types, xml_declaration=True, encoding="UTF-8", standalone=True))
+            self.zip.writestr(DOCUMENT_RELS, etree.tostring(self.rels, xml_declaration=True, encoding="UTF-8", standalone=True))
+            for name, data in self.template_parts.items():
+                self.zip.writestr(name, data)
+            for image_path, (_, part_name) in self.images.items():
+                self.zip.write(image_path, part_name, compress_type=zipfile.ZIP_STORED)
+            self.zip.close()
+            os.replace(self.tmp_path, self.output_path)
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """放弃写入：关闭 zip 并删除临时文件，output_path 保持不变。可重复调用。"""
+        self.stream.close()
+        self.zip.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -2,18 +2,54 @@
 """
 将 .docx 转为 Markdown（仅用 Python 标准库，不依赖 pandoc/python-docx）。
 支持按「前言」「第N章」自动拆分为多个 .md 文件。
+
+--all 批量模式：用进程池转换项目根目录下的全部 .docx，每个文档输出到
+manuscript/imports/<文档名>/；word/media/* 按内容哈希去重后存入
+manuscript/images 并在正文中以图片链接引用；word/comments.xml 的批注导出为
+同目录下的 comments.md。每个文档的 zip 只打开一次。
 """
+import argparse
+import hashlib
+import os
+import posixpath
 import zipfile
 import xml.etree.ElementTree as ET
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from file_utils import write_text_if_changed
+
 # OOXML 命名空间
 NS = {
     "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
 }
 
+W = "{%s}" % NS["w"]
+P_TAG = W + "p"
+T_TAG = W + "t"
+PPR_TAG = W + "pPr"
+OUTLINE_TAG = W + "outlineLvl"
+BODY_TAG = W + "body"
+VAL_ATTR = W + "val"
+ID_ATTR = W + "id"
+COMMENT_TAG = W + "comment"
+COMMENT_REF_TAG = W + "commentReference"
+R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+# 图片引用：DrawingML 的 a:blip/@r:embed 与旧式 VML 的 v:imagedata/@r:id
+IMAGE_REFS = {
+    "{http://schemas.openxmlformats.org/drawingml/2006/main}blip": R_NS + "embed",
+    "{urn:schemas-microsoft-com:vml}imagedata": R_NS + "id",
+}
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+MANUSCRIPT_DIR = PROJECT_ROOT / "manuscript"
+IMAGES_DIR = MANUSCRIPT_DIR / "images"
+IMPORTS_DIR = MANUSCRIPT_DIR / "imports"
+
+
 def extract_text_from_paragraph(p_elem):
     """从 <w:p> 中提取所有 <w:t> 的文本并拼接。"""
     texts = []
@@ -30,29 +66,80 @@ def get_paragraph_style(p_elem):
     if pPr is None:
         return None
     outline = pPr.find("w:outlineLvl", NS)
-    if outline is not None and outline.get("{http://schemas.openxmlformats.org/wordprocessingml/2006/main}val") is not None:
-        return int(outline.get("{http://schemas.openxmlformats.org/wordprocessingml/2006/main}val"))
+    if outline is not None and outline.get(VAL_ATTR) is not None:
+        return int(outline.get(VAL_ATTR))
     return None
 
-def docx_to_paragraphs(docx_path):
-    """从 docx 解压并解析 word/document.xml，返回 (段落文本, 大纲级别) 列表。"""
+def iter_paragraphs(docx_path):
+    """流式解析 word/document.xml，逐个产出 body 下顶层段落的 (段落文本, 大纲级别)。
+
+    用 iterparse 边解压边解析，每个顶层元素处理完即从树上摘除，内存占用与文档
+    大小无关；结果与 docx_to_paragraphs 旧实现（ET.parse + XPath）逐段一致。
+    """
     with zipfile.ZipFile(docx_path, "r") as z:
         with z.open("word/document.xml") as f:
-            tree = ET.parse(f)
-    root = tree.getroot()
-    body = root.find("w:body", NS)
-    if body is None:
-        return []
+            yield from iter_document_paragraphs(f)
 
-    result = []
-    for p in body.findall("w:p", NS):
-        text = extract_text_from_paragraph(p)
-        if not text:
-            result.append(("", get_paragraph_style(p)))
+def iter_document_paragraphs(f, images=None, anchors=None):
+    """iter_paragraphs 的核心，f 为已打开的 document.xml。
+
+    images：{关系 ID: 图片链接}，给出时段落中的图片在该段之后各产出一个
+    ("![](链接)", None)。anchors：给出时记录 {批注 ID: 批注所在段落文本}。
+    """
+    stack = []  # 从根到当前元素的标签
+    body = None
+    texts = []
+    level = None
+    pictures = []
+    comment_ids = []
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            stack.append(elem.tag)
+            if elem.tag == BODY_TAG and len(stack) == 2:
+                body = elem
             continue
-        lvl = get_paragraph_style(p)
-        result.append((text, lvl))
-    return result
+
+        stack.pop()
+        depth = len(stack)  # 父元素深度：document=0, body=1, 顶层段落=2
+        if depth < 3 or stack[2] != P_TAG:
+            if depth == 2 and body is not None:
+                # body 的直接子元素（段落、表格、sectPr）处理完毕
+                if elem.tag == P_TAG:
+                    text = "".join(texts).replace("\n", " ").strip()
+                    yield (text, level)
+                    for link in pictures:
+                        yield (f"![]({link})", None)
+                    if anchors is not None:
+                        for comment_id in comment_ids:
+                            anchors[comment_id] = text
+                    texts = []
+                    level = None
+                    pictures = []
+                    comment_ids = []
+                elem.clear()
+                body.remove(elem)
+            continue
+
+        # 位于顶层段落内部的元素
+        if elem.tag == T_TAG:
+            if elem.text:
+                texts.append(elem.text)
+            if elem.tail and elem.tail.strip():
+                texts.append(elem.tail)
+        elif elem.tag == OUTLINE_TAG and depth == 4 and stack[3] == PPR_TAG:
+            val = elem.get(VAL_ATTR)
+            if val is not None:
+                level = int(val)
+        elif images is not None and elem.tag in IMAGE_REFS:
+            link = images.get(elem.get(IMAGE_REFS[elem.tag]))
+            if link is not None:
+                pictures.append(link)
+        elif elem.tag == COMMENT_REF_TAG:
+            comment_ids.append(elem.get(ID_ATTR))
+
+def docx_to_paragraphs(docx_path):
+    """从 docx 解压并解析 word/document.xml，返回 (段落文本, 大纲级别) 列表。"""
+    return list(iter_paragraphs(docx_path))
 
 def paragraphs_to_markdown(paragraphs):
     """将段落列表转为单段 Markdown 文本。"""
@@ -77,7 +164,10 @@ def split_by_chapters(paragraphs):
     支持纯「前言」、纯「第N章」或「第N章 副标题」形式。
     返回: [ ("前言", [ (text, lvl), ... ]), ("第01章", [...]), ("第02章", [...]), ... ]
     """
-    chunks = []
+    return list(iter_chapters(paragraphs))
+
+def iter_chapters(paragraphs):
+    """split_by_chapters 的生成器版本：读到下一章的起始段落时即产出上一章。"""
     current_title = "前言"
     current = []
 
@@ -88,7 +178,7 @@ def split_by_chapters(paragraphs):
         # 纯「前言」
         if re.match(r"^前言\s*$", text):
             if current:
-                chunks.append((current_title, current))
+                yield (current_title, current)
             current_title = "前言"
             current = [(text, lvl)]
             continue
@@ -96,7 +186,7 @@ def split_by_chapters(paragraphs):
         m = re.match(r"^第\s*(\d+)\s*章\s*(.*)$", text)
         if m and lvl == 0:
             if current:
-                chunks.append((current_title, current))
+                yield (current_title, current)
             num = m.group(1).zfill(2)
             current_title = f"第{num}章"
             current = [(text, lvl)]
@@ -104,11 +194,145 @@ def split_by_chapters(paragraphs):
         current.append((text, lvl))
 
     if current:
-        chunks.append((current_title, current))
-    return chunks
+        yield (current_title, current)
+
+def write_chapters(chunks, out_dir):
+    """逐章写出 (标题, 段落) 块，内容未变的文件不重写。返回 (有变化, 未变化) 两个路径列表。"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    changed, unchanged = [], []
+    # 文件命名：00-前言.md, 01-第01章.md, 02-第02章.md
+    name_map = {"前言": "00-前言"}
+    for title, block in chunks:
+        if title != "前言" and title not in name_map:
+            name_map[title] = f"{len(name_map):02d}-{title}"
+        fname = name_map.get(title, title) + ".md"
+        out_path = out_dir / fname
+        md = paragraphs_to_markdown(block)
+        if write_text_if_changed(out_path, md):
+            print("已写入:", out_path)
+            changed.append(out_path)
+        else:
+            unchanged.append(out_path)
+    return changed, unchanged
+
+def print_summary(changed, unchanged):
+    total = len(changed) + len(unchanged)
+    names = "、".join(path.stem for path in unchanged)
+    print(f"共 {total} 个文件：{len(changed)} 个有变化，{len(unchanged)} 个未变化" + (f"（{names}）" if names else ""))
+
+def extract_media(z, images_dir):
+    """把 word/media/* 按内容哈希命名存入 images_dir，返回 {包内路径: 文件名}。
+
+    同一张图片（字节相同）无论出现在哪个文档里都只保存一份。
+    """
+    saved = {}
+    for name in z.namelist():
+        if not name.startswith("word/media/") or name.endswith("/"):
+            continue
+        data = z.read(name)
+        ext = posixpath.splitext(name)[1].lower()
+        fname = f"docx-{hashlib.sha256(data).hexdigest()[:16]}{ext}"
+        target = images_dir / fname
+        if not target.exists():
+            images_dir.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f".{fname}.{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, target)
+        saved[name] = fname
+    return saved
+
+def image_relationships(z, media, link_prefix):
+    """读取 document.xml.rels，返回 {关系 ID: 图片链接}。"""
+    try:
+        root = ET.fromstring(z.read("word/_rels/document.xml.rels"))
+    except KeyError:
+        return {}
+    images = {}
+    for rel in root.iter(REL_NS + "Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = posixpath.normpath(posixpath.join("word", rel.get("Target", "")))
+        if target in media:
+            images[rel.get("Id")] = link_prefix + media[target]
+    return images
+
+def read_comments(z):
+    """读取 word/comments.xml，返回 [{id, author, date, text}]；没有批注时为空列表。"""
+    try:
+        root = ET.fromstring(z.read("word/comments.xml"))
+    except KeyError:
+        return []
+    comments = []
+    for comment in root.iter(COMMENT_TAG):
+        text = "\n".join(filter(None, (extract_text_from_paragraph(p) for p in comment.iter(P_TAG))))
+        comments.append({
+            "id": comment.get(ID_ATTR),
+            "author": comment.get(W + "author", ""),
+            "date": comment.get(W + "date", ""),
+            "text": text,
+        })
+    return comments
+
+def comments_to_markdown(docx_name, comments, anchors):
+    lines = [f"# 批注：{docx_name}", ""]
+    for c in comments:
+        anchor = anchors.get(c["id"], "")
+        if len(anchor) > 60:
+            anchor = anchor[:60] + "…"
+        meta = " ".join(filter(None, (c["author"], c["date"][:10])))
+        lines.append(f"- **{meta or '批注'}**" + (f" ——「{anchor}」" if anchor else ""))
+        for line in c["text"].splitlines():
+            lines.append(f"  > {line}")
+        lines.append("")
+    return "\n".join(lines)
+
+def convert_docx(docx_path, out_dir=None, images_dir=IMAGES_DIR):
+    """批量模式下转换单个文档：拆章写出 Markdown、提取配图与批注。
+
+    返回 (文档名, 有变化的章节数, 未变化的章节数, 图片数, 批注数)。
+    """
+    docx_path = Path(docx_path)
+    out_dir = out_dir or IMPORTS_DIR / docx_path.stem
+    link_prefix = Path(os.path.relpath(images_dir, out_dir)).as_posix() + "/"
+    with zipfile.ZipFile(docx_path, "r") as z:
+        media = extract_media(z, images_dir)
+        images = image_relationships(z, media, link_prefix)
+        comments = read_comments(z)
+        anchors = {}
+        with z.open("word/document.xml") as f:
+            paragraphs = iter_document_paragraphs(f, images, anchors)
+            changed, unchanged = write_chapters(iter_chapters(paragraphs), out_dir)
+    if comments:
+        sidecar = out_dir / "comments.md"
+        if write_text_if_changed(sidecar, comments_to_markdown(docx_path.name, comments, anchors)):
+            print("已写入:", sidecar)
+    return (docx_path.name, len(changed), len(unchanged), len(media), len(comments))
+
+def convert_all(docx_paths, jobs=0):
+    """用进程池并行转换多个文档；jobs 为 0 时使用全部 CPU 核心。"""
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    if jobs <= 1 or len(docx_paths) <= 1:
+        return [convert_docx(path) for path in docx_paths]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(docx_paths))) as pool:
+        return list(pool.map(convert_docx, docx_paths))
 
 def main():
-    project_root = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="将 .docx 转为按章拆分的 Markdown")
+    parser.add_argument("--all", action="store_true", help="批量转换项目根目录下的全部 .docx（输出到 manuscript/imports/）")
+    parser.add_argument("--jobs", "-j", type=int, default=0, help="批量模式的并行进程数，0 表示使用全部 CPU 核心")
+    args = parser.parse_args()
+
+    project_root = PROJECT_ROOT
+    if args.all:
+        # 跳过 Word 打开文档时留下的 ~$ 锁文件
+        docx_paths = sorted(p for p in project_root.glob("*.docx") if not p.name.startswith("~$"))
+        if not docx_paths:
+            print("未找到 .docx 文件", file=sys.stderr)
+            sys.exit(1)
+        for name, changed, unchanged, media, comments in convert_all(docx_paths, args.jobs):
+            print(f"{name}: {changed} 个文件有变化，{unchanged} 个未变化，{media} 张图片，{comments} 条批注")
+        return
+
     docx_path = project_root / "前言+第1章+第2章（批注）.docx"
     if not docx_path.exists():
         # 尝试从当前目录找
@@ -120,24 +344,8 @@ def main():
             print("未找到 .docx 文件", file=sys.stderr)
             sys.exit(1)
 
-    manuscript_dir = project_root / "manuscript"
-    manuscript_dir.mkdir(exist_ok=True)
-
-    paragraphs = docx_to_paragraphs(docx_path)
-    chunks = split_by_chapters(paragraphs)
-
-    # 文件命名：00-前言.md, 01-第01章.md, 02-第02章.md
-    name_map = {"前言": "00-前言"}
-    for i, (title, _) in enumerate(chunks):
-        if title != "前言" and title not in name_map:
-            name_map[title] = f"{len(name_map):02d}-{title}"
-
-    for title, block in chunks:
-        fname = name_map.get(title, title) + ".md"
-        out_path = manuscript_dir / fname
-        md = paragraphs_to_markdown(block)
-        out_path.write_text(md, encoding="utf-8")
-        print("已写入:", out_path)
+    # 边解析边拆分：每读完一章就写出该章，不必等整篇文档解析完
+    print_summary(*write_chapters(iter_chapters(iter_paragraphs(docx_path)), MANUSCRIPT_DIR))
 
 if __name__ == "__main__":
     main()
@@ -3,27 +3,41 @@
 """统一导出全书 Word。
 
 流程：
-1. 合并分章稿 -> full-book.md
-2. 修正弯引号
-3. 准备 reference.docx（修复 Heading 4 斜体、Caption 样式）
-4. 调用 pandoc 导出 docx
-5. 后处理 docx：图片居中、图片标题置于下方并居中、标题后空一行
+1. 合并分章稿、修正弯引号（全部在内存中完成）
+2. 一次性原子写出 full-book.md 作为成品（--no-md 时不写）
+3. 补全图题、图片链接替换为缩放压缩后的派生图（见 build_image_assets.py），经标准输入交给 pandoc
+4. 准备 reference.docx（修复 Heading 4 斜体、Caption 样式；按指纹缓存于 .cache/reference）
+5. 调用 pandoc 导出 docx
+   （docx_layout.lua 过滤器直接生成居中图片与图题；标题的分页属性来自 reference.docx 样式，
+   表格行的不跨页、单元格段落的与下段同页直接写在每一行上，见 set_table_row_layout）
+   --per-chapter 时各章分别并行转换（按章节内容与所嵌图片的内容缓存于 .cache/chapter-docx），再由 merge_docx.py 合并
 """
 
 from __future__ import annotations
 
+import argparse
+import hashlib
+import os
 import re
 import subprocess
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
 
 from docx import Document
 from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import OxmlElement
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn
 from docx.shared import Pt
-from docx.text.paragraph import Paragraph
+from lxml import etree
 
+import build_image_assets
+import file_utils
 import fix_quotes
+import merge_docx
 import merge_full_book
 
 
@@ -32,9 +46,115 @@ MANUSCRIPT_DIR = ROOT / "manuscript"
 FULL_BOOK_MD = MANUSCRIPT_DIR / "full-book.md"
 FULL_BOOK_DOCX = MANUSCRIPT_DIR / "full-book.docx"
 REFERENCE_DOCX = ROOT / "templates" / "reference.docx"
+REFERENCE_CACHE_DIR = ROOT / ".cache" / "reference"
+LAYOUT_FILTER = Path(__file__).resolve().parent / "docx_layout.lua"
+CHAPTER_DOCX_CACHE_DIR = ROOT / ".cache" / "chapter-docx"
 
+# 分章转换缓存的版本号：修改 pandoc 参数时递增。
+CHAPTER_DOCX_VERSION = "2"
 
-def ensure_reference_docx() -> None:
+# 样式设置；修改样式逻辑（不只是数值）时递增版本号，使缓存的模板失效。
+REFERENCE_STYLE_VERSION = "2"
+NON_ITALIC_HEADINGS = ("Heading 3", "Heading 4", "Heading 5", "Heading 6")
+HEADING_SPACE_BEFORE = 12
+CAPTION_FONT_SIZE = 10.5
+FIGURE_STYLES = ("Figure", "Captioned Figure")
+
+IMAGE_LINE_RE = re.compile(r"^([ \t]*)!\[(.*?)\]\(([^)\n]*?)\)([ \t]*)$", re.MULTILINE)
+
+
+def apply_heading_styles(doc) -> None:
+    """所有标题与下段同页、段中不分页、段前 12 磅；标题 3–6 取消斜体。"""
+    for style in doc.styles:
+        if style.type != WD_STYLE_TYPE.PARAGRAPH or not style.name.startswith("Heading "):
+            continue
+        style.paragraph_format.keep_with_next = True
+        style.paragraph_format.keep_together = True
+        style.paragraph_format.space_before = Pt(HEADING_SPACE_BEFORE)
+        if style.name in NON_ITALIC_HEADINGS:
+            style.font.italic = False
+
+
+def apply_figure_styles(doc) -> None:
+    """图片段落居中，并与其后的图题保持在同一页。"""
+    style_names = {style.name for style in doc.styles}
+    for name in FIGURE_STYLES:
+        style = doc.styles[name] if name in style_names else doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        style.paragraph_format.keep_with_next = True
+
+
+def apply_table_style(doc) -> None:
+    """pandoc 表格使用「Table」样式：表格行不跨页拆分，单元格段落与下段同页、段中不分页。
+
+    样式中的行属性不一定生效，导出后还会由 set_table_row_layout 逐行写入。
+    """
+    table_style = next((style for style in doc.styles if style.name == "Table"), None)
+    if table_style is None:
+        return
+    table_style.paragraph_format.keep_with_next = True
+    table_style.paragraph_format.keep_together = True
+
+    style_element = table_style.element
+    trPr = style_element.find(qn("w:trPr"))
+    if trPr is None:
+        trPr = OxmlElement("w:trPr")
+        successor = style_element.find(qn("w:tcPr"))
+        if successor is None:
+            successor = style_element.find(qn("w:tblStylePr"))
+        if successor is not None:
+            successor.addprevious(trPr)
+        else:
+            style_element.append(trPr)
+    if trPr.find(qn("w:cantSplit")) is None:
+        trPr.append(OxmlElement("w:cantSplit"))
+
+
+def set_table_row_layout(docx_path: Path) -> None:
+    """每个表格行设为不跨页拆分，单元格段落与下段同页、段中不分页。
+
+    Word 不一定把表格样式中的 trPr 套用到没有自身行属性的行上，因此与旧版后处理
+    一样逐行写入；只改写 word/document.xml，其余部件原样拷贝。
+    """
+    with zipfile.ZipFile(docx_path) as z:
+        document = parse_xml(z.read("word/document.xml"))
+        rows = list(document.iter(qn("w:tr")))
+        if not rows:
+            return
+        for tr in rows:
+            trPr = tr.get_or_add_trPr()
+            if trPr.find(qn("w:cantSplit")) is None:
+                trPr.append(OxmlElement("w:cantSplit"))
+            for tc in tr.iterchildren(qn("w:tc")):
+                for p in tc.iter(qn("w:p")):
+                    pPr = p.get_or_add_pPr()
+                    pPr.keepNext_val = True
+                    pPr.keepLines_val = True
+
+        tmp_path = docx_path.with_name(f".{docx_path.stem}.{os.getpid()}.layout{docx_path.suffix}")
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as out:
+                for info in z.infolist():
+                    if info.filename == "word/document.xml":
+                        out.writestr(info, etree.tostring(document, xml_declaration=True, encoding="UTF-8", standalone=True))
+                    else:
+                        out.writestr(info, z.read(info))
+            os.replace(tmp_path, docx_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+def reference_fingerprint(template_bytes: bytes) -> str:
+    """源模板内容 + 样式设置的指纹，任一变化都会生成新的缓存模板。"""
+    digest = hashlib.sha256()
+    digest.update(template_bytes)
+    settings = (REFERENCE_STYLE_VERSION, NON_ITALIC_HEADINGS, HEADING_SPACE_BEFORE, CAPTION_FONT_SIZE, FIGURE_STYLES)
+    digest.update(repr(settings).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def ensure_reference_docx() -> Path:
+    """返回调整过样式的 reference.docx；按指纹缓存，源模板本身不再被改写。"""
     REFERENCE_DOCX.parent.mkdir(parents=True, exist_ok=True)
     if not REFERENCE_DOCX.exists():
         result = subprocess.run(
@@ -44,147 +164,63 @@ def ensure_reference_docx() -> None:
         )
         REFERENCE_DOCX.write_bytes(result.stdout)
 
-    doc = Document(str(REFERENCE_DOCX))
-
-    heading4 = doc.styles["Heading 4"]
-    heading4.font.italic = False
-    heading4.paragraph_format.space_before = Pt(12)
+    template_bytes = REFERENCE_DOCX.read_bytes()
+    styled_path = REFERENCE_CACHE_DIR / f"reference-{reference_fingerprint(template_bytes)}.docx"
+    if styled_path.exists():
+        return styled_path
 
-    heading5 = doc.styles["Heading 5"]
-    heading5.font.italic = False
-    heading5.paragraph_format.space_before = Pt(10)
-
-    if "Heading 3" in [style.name for style in doc.styles]:
-        heading3 = doc.styles["Heading 3"]
-        heading3.font.italic = False
-        heading3.paragraph_format.space_before = Pt(14)
-
-    if "Heading 6" in [style.name for style in doc.styles]:
-        heading6 = doc.styles["Heading 6"]
-        heading6.font.italic = False
-        heading6.paragraph_format.space_before = Pt(8)
+    doc = Document(BytesIO(template_bytes))
+    apply_heading_styles(doc)
+    apply_figure_styles(doc)
+    apply_table_style(doc)
 
     caption = next((style for style in doc.styles if style.name == "Caption"), None)
     if caption is None:
         caption = doc.styles.add_style("Caption", WD_STYLE_TYPE.PARAGRAPH)
 
     caption.font.italic = False
-    caption.font.size = Pt(10.5)
+    caption.font.size = Pt(CAPTION_FONT_SIZE)
     caption.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
     caption.paragraph_format.space_before = Pt(0)
     caption.paragraph_format.space_after = Pt(0)
 
-    doc.save(str(REFERENCE_DOCX))
+    REFERENCE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = styled_path.with_name(f".{styled_path.name}.{os.getpid()}.tmp")
+    try:
+        doc.save(str(tmp_path))
+        os.replace(tmp_path, styled_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return styled_path
 
 
-def collect_existing_image_captions(md_text: str) -> list[str]:
-    captions: list[str] = []
-    pattern = re.compile(r"^!\[(.*?)\]\((.*?)\)\s*$")
-    for line in md_text.splitlines():
-        match = pattern.match(line.strip())
-        if not match:
-            continue
-        caption, rel_path = match.groups()
+def fill_image_captions(md_text: str) -> str:
+    """没有说明文字的本地图片用文件名补上图题（下划线换成空格），供 docx_layout.lua 生成图题。"""
+
+    def replace(match: re.Match) -> str:
+        indent, caption, rel_path, trailing = match.groups()
         image_path = MANUSCRIPT_DIR / rel_path
-        if not image_path.exists():
-            continue
-        clean_caption = caption.strip() or image_path.stem.replace("_", " ")
-        captions.append(clean_caption)
-    return captions
-
-
-def paragraph_has_image(paragraph: Paragraph) -> bool:
-    return bool(paragraph._p.xpath(".//w:drawing"))
-
-
-def delete_paragraph(paragraph: Paragraph) -> None:
-    p = paragraph._element
-    parent = p.getparent()
-    if parent is not None:
-        parent.remove(p)
-    paragraph._p = paragraph._element = None
-
-
-def insert_paragraph_after(paragraph: Paragraph, text: str = "", style=None) -> Paragraph:
-    new_p = OxmlElement("w:p")
-    paragraph._p.addnext(new_p)
-    new_para = Paragraph(new_p, paragraph._parent)
-    if text:
-        new_para.add_run(text)
-    if style is not None:
-        new_para.style = style
-    return new_para
-
-
-def postprocess_docx(docx_path: Path, captions: list[str]) -> None:
-    doc = Document(str(docx_path))
-
-    heading4 = doc.styles["Heading 4"]
-    heading4.font.italic = False
-    heading4.paragraph_format.space_before = Pt(12)
-    heading5 = doc.styles["Heading 5"]
-    heading5.font.italic = False
-    heading5.paragraph_format.space_before = Pt(10)
-    if "Heading 3" in [style.name for style in doc.styles]:
-        heading3 = doc.styles["Heading 3"]
-        heading3.font.italic = False
-        heading3.paragraph_format.space_before = Pt(14)
-    if "Heading 6" in [style.name for style in doc.styles]:
-        heading6 = doc.styles["Heading 6"]
-        heading6.font.italic = False
-        heading6.paragraph_format.space_before = Pt(8)
-    caption_style = next((style for style in doc.styles if style.name == "Caption"), None)
-
-    image_paragraphs = [p for p in doc.paragraphs if paragraph_has_image(p)]
-    for paragraph, caption_text in zip(image_paragraphs, captions):
-        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        caption_para = insert_paragraph_after(paragraph, caption_text, style=caption_style)
-        caption_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        caption_para.paragraph_format.space_before = Pt(0)
-        caption_para.paragraph_format.space_after = Pt(0)
-
-        spacer_para = insert_paragraph_after(caption_para, "")
-        spacer_para.paragraph_format.space_before = Pt(0)
-        spacer_para.paragraph_format.space_after = Pt(0)
-
-        # 删除 pandoc 已生成的重复图片标题，只保留我们统一插入的居中标题。
-        next_para = spacer_para._p.getnext()
-        if next_para is not None:
-            duplicate = Paragraph(next_para, spacer_para._parent)
-            style_name = duplicate.style.name if duplicate.style is not None else ""
-            if duplicate.text.strip() == caption_text.strip() or style_name in {"Image Caption", "Caption"}:
-                delete_paragraph(duplicate)
-
-    # 让表格尽量整体留在同一页：表格前段落与表格保持一起，表格行不拆页。
-    for paragraph in doc.paragraphs:
-        paragraph_format = paragraph.paragraph_format
-        if paragraph.style and paragraph.style.name.startswith("Heading"):
-            paragraph_format.keep_with_next = True
-            paragraph_format.keep_together = True
-            paragraph_format.space_before = Pt(12)
-
-    for table in doc.tables:
-        tbl = table._tbl
-        for row in table.rows:
-            trPr = row._tr.get_or_add_trPr()
-            cant_split = OxmlElement("w:cantSplit")
-            trPr.append(cant_split)
-            for cell in row.cells:
-                for p in cell.paragraphs:
-                    p.paragraph_format.keep_with_next = True
-                    p.paragraph_format.keep_together = True
-
-    doc.save(str(docx_path))
-
-
-def export_docx() -> None:
+        if caption.strip() or not image_path.exists():
+            return match.group(0)
+        return f"{indent}![{image_path.stem.replace('_', ' ')}]({rel_path}){trailing}"
+
+    return IMAGE_LINE_RE.sub(replace, md_text)
+
+
+def build_markdown(jobs: int = 1) -> list[str]:
+    """内存中完成合并与弯引号修正，按章返回片段（直接拼接即为全书）。"""
+    segments = merge_full_book.build_segments(jobs=jobs)
+    # 引号只在段落内配对，而每章都以空行结尾，逐章修正与全文修正结果相同。
+    return [fix_quotes.fix_quotes(segment) for segment in segments]
+
+
+def export_docx(reference_docx: Path, md_text: str, output: Path = FULL_BOOK_DOCX) -> None:
+    """用 pandoc 导出 docx，Markdown 经标准输入传入；再逐行写入表格的分页属性。"""
     subprocess.run(
         [
             "pandoc",
-            str(FULL_BOOK_MD),
             "-o",
-            str(FULL_BOOK_DOCX),
+            str(output),
             "--from",
             "markdown",
             "--to",
@@ -192,23 +228,97 @@ def export_docx() -> None:
             "--resource-path",
             str(MANUSCRIPT_DIR),
             "--reference-doc",
-            str(REFERENCE_DOCX),
+            str(reference_docx),
+            "--lua-filter",
+            str(LAYOUT_FILTER),
         ],
         cwd=str(ROOT),
+        input=md_text.encode("utf-8"),
         check=True,
     )
-
-
-def main() -> None:
-    merge_full_book.main()
-
-    text = FULL_BOOK_MD.read_text(encoding="utf-8")
-    FULL_BOOK_MD.write_text(fix_quotes.fix_quotes(text), encoding="utf-8")
-
-    ensure_reference_docx()
-    captions = collect_existing_image_captions(FULL_BOOK_MD.read_text(encoding="utf-8"))
-    export_docx()
-    postprocess_docx(FULL_BOOK_DOCX, captions)
+    set_table_row_layout(output)
+
+
+def pandoc_version() -> str:
+    result = subprocess.run(["pandoc", "--version"], check=True, capture_output=True, text=True)
+    return result.stdout.splitlines()[0]
+
+
+def image_digest(path: Path) -> str:
+    """图片内容的哈希（按路径、大小与 mtime 记忆）；文件不存在时返回 "missing"。"""
+    try:
+        st = path.stat()
+    except OSError:
+        return "missing"
+    return _image_digest(str(path), st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def _image_digest(path: str, size: int, mtime_ns: int) -> str:
+    return file_utils.file_digest(Path(path)).hex()
+
+
+def export_docx_per_chapter(reference_docx: Path, segments: list[str], jobs: int) -> None:
+    """各章分别转换为 docx（按内容缓存、并行），再按顺序合并为 full-book.docx。"""
+    salt = hashlib.sha256()
+    salt.update(repr((CHAPTER_DOCX_VERSION, pandoc_version(), reference_docx.name)).encode("utf-8"))
+    salt.update(LAYOUT_FILTER.read_bytes())
+
+    def convert(segment: str) -> tuple[Path, bool]:
+        digest = salt.copy()
+        digest.update(segment.encode("utf-8"))
+        # 嵌入的图片也计入缓存键：同一路径下重新生成的图片会触发重新转换
+        for link in sorted({match.group(2) for match in build_image_assets.IMAGE_LINK_RE.finditer(segment)}):
+            digest.update(f"\0{link}\0{image_digest(MANUSCRIPT_DIR / link)}".encode("utf-8"))
+        target = CHAPTER_DOCX_CACHE_DIR / f"{digest.hexdigest()[:24]}.docx"
+        if target.exists():
+            return target, True
+        CHAPTER_DOCX_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.stem}.{os.getpid()}.tmp.docx")
+        try:
+            export_docx(reference_docx, segment, output=tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return target, False
+
+    # pandoc 是独立进程，线程池即可让各章转换同时占满多个核心。
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(convert, segments))
+
+    hits = sum(1 for _, hit in results if hit)
+    print(f"分章 docx：缓存命中 {hits}，重新转换 {len(results) - hits}")
+    merge_docx.merge_docx([path for path, _ in results], FULL_BOOK_DOCX)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="导出全书 Word")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="合并章节时的并行进程数，0 表示使用全部 CPU 核心")
+    parser.add_argument("--no-md", action="store_true", help="不写出 full-book.md（pandoc 始终从标准输入读取）")
+    parser.add_argument(
+        "--images",
+        choices=["original", *sorted(build_image_assets.PROFILES)],
+        default="print",
+        help="嵌入的图片版本：original 为原图，print/screen 为缩放压缩后的派生图",
+    )
+    parser.add_argument("--per-chapter", action="store_true", help="各章分别并行调用 pandoc（按章缓存），再合并为一个 docx")
+    args = parser.parse_args(argv)
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    segments = build_markdown(jobs=jobs)
+    if not args.no_md:
+        file_utils.write_text_atomic(FULL_BOOK_MD, "".join(segments))
+
+    # full-book.md 保持原样；交给 pandoc 的文本才补图题、替换为派生图。
+    pandoc_segments = [fill_image_captions(segment) for segment in segments]
+    if args.images != "original":
+        pandoc_segments = build_image_assets.rewrite_image_links_many(pandoc_segments, MANUSCRIPT_DIR, args.images)
+
+    reference_docx = ensure_reference_docx()
+    if args.per_chapter:
+        export_docx_per_chapter(reference_docx, pandoc_segments, jobs)
+    else:
+        export_docx(reference_docx, "".join(pandoc_segments))
 
     print(f"已生成：{FULL_BOOK_DOCX}")
 
@@ -4,38 +4,223 @@
 将 Markdown 文件转换为 Word 文档，保持格式一致并嵌入图片
 """
 
+import argparse
 import re
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import groupby
 from pathlib import Path
+from typing import NamedTuple, Optional
 from docx import Document
-from docx.shared import Inches, Pt, Cm
+from docx.document import Document as DocumentObject
+from docx.shared import Inches, Pt, Cm, Emu, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.style import WD_STYLE_TYPE
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
+from docx.oxml.styles import styleId_from_name
+from docx.text.paragraph import Paragraph
 
+import build_image_assets
+import docx_stream
+import merge_docx
 
-def set_chinese_font(run, font_name='微软雅黑', font_size=12):
-    """设置中文字体"""
-    run.font.name = font_name
-    run.font.size = Pt(font_size)
-    r = run._element
-    rPr = r.get_or_add_rPr()
-    rFonts = rPr.get_or_add_rFonts()
+
+ROOT = Path(__file__).resolve().parent.parent
+MANUSCRIPT_DIR = ROOT / 'manuscript'
+# 章节文件：00-前言.md、01-第01章.md ……（不含「-结构稿」等草稿）
+CHAPTER_FILE_RE = re.compile(r'(\d{2})-(前言|第\d{2}章)\.md')
+
+
+BODY_FONT = '微软雅黑'
+CODE_FONT = 'Consolas'
+
+# 标题级别 → (样式名, 字号)；一级标题用 Title 样式
+HEADING_STYLES = {1: ('Title', 14), 2: ('Heading 2', 12), 3: ('Heading 3', 10), 4: ('Heading 4', 11)}
+
+# 行内格式对应的字符样式
+BOLD_STYLE = 'Body Bold'
+ITALIC_STYLE = 'Body Italic'
+BOLD_ITALIC_STYLE = 'Body Bold Italic'
+LINK_STYLE = 'Link'
+CODE_STYLE = 'Inline Code'
+QUOTE_CODE_STYLE = 'Inline Code Italic'
+# 段落样式
+CODE_BLOCK_STYLE = 'Code Block'
+QUOTE_STYLE = 'Block Quote'
+CAPTION_STYLE = 'Figure Caption'
+BULLET_STYLE = 'List Bullet'
+TABLE_STYLE = 'Table Grid'
+NUMBER_STYLE = 'List Number'
+
+
+def add_paragraph(container, style=None, text=None):
+    """按样式名添加段落。
+
+    直接写入 pStyle 样式 ID，而不经 python-docx 按名称查找样式：
+    后者每次都要遍历整个样式表，在全书规模下是主要开销。
+    """
+    p = container.add_paragraph(text)
+    if style is not None:
+        p._p.style = styleId_from_name(style)
+    return p
+
+
+def add_run(paragraph, text, style=None):
+    """按字符样式名添加 run（同样直接写入 rStyle 样式 ID）。"""
+    run = paragraph.add_run(text)
+    if style is not None:
+        run._r.style = styleId_from_name(style)
+    return run
+
+
+def set_style_font(style, font_name=BODY_FONT, font_size=None):
+    """设置样式字体（含中文 eastAsia 字体），并去掉会覆盖它的主题字体。"""
+    style.font.name = font_name
+    if font_size is not None:
+        style.font.size = Pt(font_size)
+    rFonts = style.element.get_or_add_rPr().get_or_add_rFonts()
     rFonts.set(qn('w:eastAsia'), font_name)
+    for attr in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme'):
+        rFonts.attrib.pop(qn(attr), None)
+
+
+def add_style(styles, name, style_type, base='Normal'):
+    if name in [s.name for s in styles]:
+        return styles[name]
+    style = styles.add_style(name, style_type)
+    if style_type == WD_STYLE_TYPE.PARAGRAPH:
+        style.base_style = styles[base]
+    return style
 
 
 def create_document_styles(doc):
-    """创建文档样式"""
+    """创建文档样式
+
+    字体、字号等格式全部定义在样式里，正文中的 run 只引用样式名，
+    不再逐个写入 rPr，document.xml 更小，Word 打开也更快。
+    """
     styles = doc.styles
     
     # 正文样式
     style = styles['Normal']
-    style.font.name = '微软雅黑'
-    style.font.size = Pt(11)
-    style._element.rPr.rFonts.set(qn('w:eastAsia'), '微软雅黑')
+    set_style_font(style, BODY_FONT, 11)
     style.paragraph_format.line_spacing = 1.5
     style.paragraph_format.space_after = Pt(6)
+    
+    # 标题
+    for style_name, size in HEADING_STYLES.values():
+        set_style_font(styles[style_name], BODY_FONT, size)
+    
+    # 字符样式：加粗、斜体（含公式）、粗斜体、链接、行内代码（及引用中的斜体代码）
+    style = add_style(styles, BOLD_STYLE, WD_STYLE_TYPE.CHARACTER)
+    style.font.bold = True
+    style = add_style(styles, ITALIC_STYLE, WD_STYLE_TYPE.CHARACTER)
+    style.font.italic = True
+    style = add_style(styles, BOLD_ITALIC_STYLE, WD_STYLE_TYPE.CHARACTER)
+    style.font.bold = True
+    style.font.italic = True
+    style = add_style(styles, LINK_STYLE, WD_STYLE_TYPE.CHARACTER)
+    style.font.color.rgb = RGBColor(0x05, 0x63, 0xC1)
+    style.font.underline = True
+    style = add_style(styles, CODE_STYLE, WD_STYLE_TYPE.CHARACTER)
+    style.font.name = CODE_FONT
+    style.font.size = Pt(10)
+    style = add_style(styles, QUOTE_CODE_STYLE, WD_STYLE_TYPE.CHARACTER)
+    style.font.name = CODE_FONT
+    style.font.size = Pt(10)
+    style.font.italic = True
+    
+    # 段落样式：代码块、引用、图题
+    style = add_style(styles, CODE_BLOCK_STYLE, WD_STYLE_TYPE.PARAGRAPH)
+    style.font.name = CODE_FONT
+    style.font.size = Pt(9)
+    style.paragraph_format.left_indent = Cm(1)
+    # 引用的斜体由 run 的字符样式提供（见 QUOTE_RUN_STYLES）：斜体是开关属性，
+    # 段落样式与字符样式都设斜体会相互抵消，引用中的 *强调* 反而变成正体。
+    style = add_style(styles, QUOTE_STYLE, WD_STYLE_TYPE.PARAGRAPH)
+    style.paragraph_format.left_indent = Cm(1)
+    style.paragraph_format.first_line_indent = Cm(0)
+    style = add_style(styles, CAPTION_STYLE, WD_STYLE_TYPE.PARAGRAPH)
+    style.font.italic = True
+    style.font.size = Pt(9)
+    style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+def parse_alignments(separator):
+    """由表格分隔行（如 |:---|:---:|---:|）得到各列对齐方式。"""
+    alignments = []
+    for cell in separator.split('|')[1:-1]:
+        cell = cell.strip()
+        if cell.startswith(':') and cell.endswith(':'):
+            alignments.append('center')
+        elif cell.endswith(':'):
+            alignments.append('right')
+        elif cell.startswith(':'):
+            alignments.append('left')
+        else:
+            alignments.append(None)
+    return alignments
+
+
+def add_table(doc, rows, alignments=()):
+    """直接拼出 w:tbl/w:tr/w:tc 并一次插入正文，耗时与单元格数成线性。
+
+    python-docx 的 table.cell(row, col) 每次调用都会重新计算整张表的网格，
+    逐格填写大表是平方级开销。列数取最长的一行，较短的行以空单元格补齐；
+    alignments 为各列对齐方式（'left'/'center'/'right'/None）。
+    """
+    num_cols = max(len(row) for row in rows)
+    section = doc.sections[-1]
+    block_width = section.page_width - section.left_margin - section.right_margin
+    col_width = str(Emu(block_width // num_cols).twips)
+
+    tbl = OxmlElement('w:tbl')
+    tblPr = OxmlElement('w:tblPr')
+    tbl_style = OxmlElement('w:tblStyle')
+    tbl_style.set(qn('w:val'), styleId_from_name(TABLE_STYLE))
+    tblW = OxmlElement('w:tblW')
+    tblW.set(qn('w:type'), 'auto')
+    tblW.set(qn('w:w'), '0')
+    tblLook = OxmlElement('w:tblLook')
+    for attr, val in (('firstRow', '1'), ('lastRow', '0'), ('firstColumn', '1'), ('lastColumn', '0'),
+                      ('noHBand', '0'), ('noVBand', '1'), ('val', '04A0')):
+        tblLook.set(qn(f'w:{attr}'), val)
+    tblPr.extend([tbl_style, tblW, tblLook])
+    tblGrid = OxmlElement('w:tblGrid')
+    for _ in range(num_cols):
+        grid_col = OxmlElement('w:gridCol')
+        grid_col.set(qn('w:w'), col_width)
+        tblGrid.append(grid_col)
+    tbl.extend([tblPr, tblGrid])
+
+    for row in rows:
+        tr = OxmlElement('w:tr')
+        for col_idx in range(num_cols):
+            tc = OxmlElement('w:tc')
+            tcPr = OxmlElement('w:tcPr')
+            tcW = OxmlElement('w:tcW')
+            tcW.set(qn('w:type'), 'dxa')
+            tcW.set(qn('w:w'), col_width)
+            tcPr.append(tcW)
+            p = OxmlElement('w:p')
+            align = alignments[col_idx] if col_idx < len(alignments) else None
+            if align:
+                pPr = OxmlElement('w:pPr')
+                jc = OxmlElement('w:jc')
+                jc.set(qn('w:val'), align)
+                pPr.append(jc)
+                p.append(pPr)
+            tc.extend([tcPr, p])
+            tr.append(tc)
+            if col_idx < len(row) and row[col_idx]:
+                add_formatted_text(Paragraph(p, doc._body), row[col_idx])
+        tbl.append(tr)
+
+    doc.element.body._insert_tbl(tbl)
 
 
 def parse_markdown_line(line, doc, images_dir, in_table=False, in_code_block=False):
@@ -73,7 +258,7 @@ def parse_markdown_line(line, doc, images_dir, in_table=False, in_code_block=Fal
     if stripped.startswith('|') and stripped.endswith('|'):
         # 检查是否是分隔行
         if re.match(r'^\|[\s\-:|]+\|$', stripped):
-            return ('table_separator',), True, in_code_block
+            return ('table_separator', parse_alignments(stripped)), True, in_code_block
         cells = [cell.strip() for cell in stripped.split('|')[1:-1]]
         return ('table_row', cells), True, in_code_block
     
@@ -100,44 +285,316 @@ def parse_markdown_line(line, doc, images_dir, in_table=False, in_code_block=Fal
     return ('paragraph', stripped), False, in_code_block
 
 
-def add_formatted_text(paragraph, text):
-    """添加带格式的文本（处理加粗、斜体、行内代码等）"""
-    # 处理加粗、斜体、代码等
-    pattern = r'(\*\*[^*]+\*\*|\*[^*]+\*|`[^`]+`|\$\$[^$]+\$\$|\$[^$]+\$)'
-    parts = re.split(pattern, text)
+class Span(NamedTuple):
+    text: str
+    style: Optional[str] = None  # 字符样式名
+    link: Optional[str] = None   # 超链接目标
+
+
+# 行内标记的起始符号：转义、反引号串、$$/$、**/*、![、[
+INLINE_TOKEN_RE = re.compile(r'\\[!-/:-@\[-`{-~]|`+|\$\$?|\*\*?|!?\[')
+LINK_TAIL_RE = re.compile(r'\]\(([^()\s]*(?:\([^()\s]*\)[^()\s]*)*)(?:\s+"[^"]*")?\)')
+
+
+def span_style(bold, italic):
+    if bold and italic:
+        return BOLD_ITALIC_STYLE
+    if bold:
+        return BOLD_STYLE
+    if italic:
+        return ITALIC_STYLE
+    return None
+
+
+def _parse_inline(text, spans, bold=False, italic=False, link=None):
+    """把 text 解析为 Span 追加到 spans；bold/italic/link 为外层（链接文字）继承的状态。"""
+    buf = []
+    
+    def flush():
+        chunk = ''.join(buf)
+        if chunk:
+            spans.append(Span(chunk, span_style(bold, italic), link))
+        buf.clear()
     
-    for part in parts:
-        if not part:
+    i, n = 0, len(text)
+    while i < n:
+        m = INLINE_TOKEN_RE.search(text, i)
+        if m is None:
+            buf.append(text[i:])
+            break
+        buf.append(text[i:m.start()])
+        tok = m.group()
+        i = m.end()
+        
+        if tok[0] == '\\':
+            # 转义：\* \` 等按字面输出
+            buf.append(tok[1])
+        elif tok[0] == '`':
+            close = re.compile(r'(?<!`)%s(?!`)' % tok).search(text, i)
+            if close is None:
+                buf.append(tok)
+            else:
+                flush()
+                spans.append(Span(text[i:close.start()], CODE_STYLE, link))
+                i = close.end()
+        elif tok[0] == '$':
+            # 公式，简化处理为斜体
+            close = text.find(tok, i)
+            if close <= i:
+                buf.append(tok)
+            else:
+                flush()
+                spans.append(Span(text[i:close], ITALIC_STYLE, link))
+                i = close + len(tok)
+        elif tok == '**':
+            if bold or text.find('**', i) >= 0:
+                flush()
+                bold = not bold
+            else:
+                buf.append(tok)
+        elif tok == '*':
+            if italic or text.find('*', i) >= 0:
+                flush()
+                italic = not italic
+            else:
+                buf.append(tok)
+        elif tok == '![':
+            # 行内图片：整段 ![alt](src) 按原文输出（独占一行的图片由 parse_markdown_line 处理）
+            label_end = _closing_bracket(text, i)
+            tail = LINK_TAIL_RE.match(text, label_end) if label_end >= 0 else None
+            if tail is None:
+                buf.append('!')
+                i -= 1
+            else:
+                buf.append(text[m.start():tail.end()])
+                i = tail.end()
+        elif tok == '[':
+            label_end = _closing_bracket(text, i)
+            tail = LINK_TAIL_RE.match(text, label_end) if label_end >= 0 and link is None else None
+            if tail is None:
+                buf.append(tok)
+            else:
+                flush()
+                _parse_inline(text[i:label_end], spans, bold, italic, tail.group(1))
+                i = tail.end()
+    flush()
+
+
+def _closing_bracket(text, start):
+    """text[start-1] 为 [，返回与之配对的 ] 的位置；没有则返回 -1。"""
+    depth = 1
+    i = start
+    while i < len(text):
+        c = text[i]
+        if c == '\\':
+            i += 2
             continue
-        if part.startswith('**') and part.endswith('**'):
-            run = paragraph.add_run(part[2:-2])
-            run.bold = True
-            set_chinese_font(run, font_size=11)
-        elif part.startswith('*') and part.endswith('*') and not part.startswith('**'):
-            run = paragraph.add_run(part[1:-1])
-            run.italic = True
-            set_chinese_font(run, font_size=11)
-        elif part.startswith('`') and part.endswith('`'):
-            run = paragraph.add_run(part[1:-1])
-            run.font.name = 'Consolas'
-            run.font.size = Pt(10)
-        elif part.startswith('$$') and part.endswith('$$'):
-            # 块级公式，简化处理
-            run = paragraph.add_run(part[2:-2])
-            run.italic = True
-            set_chinese_font(run, font_size=11)
-        elif part.startswith('$') and part.endswith('$'):
-            # 行内公式，简化处理
-            run = paragraph.add_run(part[1:-1])
-            run.italic = True
-            set_chinese_font(run, font_size=11)
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+
+# 引用中的 run 一律为斜体：字符样式 → 对应的斜体字符样式
+QUOTE_RUN_STYLES = {
+    None: ITALIC_STYLE,
+    BOLD_STYLE: BOLD_ITALIC_STYLE,
+    CODE_STYLE: QUOTE_CODE_STYLE,
+}
+
+
+@lru_cache(maxsize=4096)
+def tokenize_inline(text, quote=False):
+    """把一段行内 Markdown 切成 Span 元组（加粗、斜体及其嵌套、行内代码、公式、链接、转义）。
+
+    quote 为 True 时（引用段落）各 Span 换成斜体的字符样式；链接文字保持链接样式。
+    结果按文本缓存：表格单元格和反复出现的固定文字（Step 行、徽标等）只解析一次。
+    """
+    spans = []
+    _parse_inline(text, spans)
+    if quote:
+        spans = [
+            span if span.link is not None and span.style is None
+            else span._replace(style=QUOTE_RUN_STYLES.get(span.style, span.style))
+            for span in spans
+        ]
+    return tuple(spans)
+
+
+def add_hyperlink(paragraph, url):
+    """在段落末尾添加 w:hyperlink 元素并返回，供其中添加 run。"""
+    hyperlink = OxmlElement('w:hyperlink')
+    if url.startswith('#'):
+        hyperlink.set(qn('w:anchor'), url[1:])
+    else:
+        hyperlink.set(qn('r:id'), paragraph.part.relate_to(url, RT.HYPERLINK, is_external=True))
+    paragraph._p.append(hyperlink)
+    return hyperlink
+
+
+def add_formatted_text(paragraph, text, quote=False):
+    """添加带格式的文本（处理加粗、斜体、行内代码、链接等）；quote 为 True 时整段斜体"""
+    hyperlink, current_link = None, None
+    for span in tokenize_inline(text, quote):
+        if span.link is None:
+            hyperlink = current_link = None
+            add_run(paragraph, span.text, span.style)
+            continue
+        if span.link != current_link:
+            hyperlink, current_link = add_hyperlink(paragraph, span.link), span.link
+        run = add_run(paragraph, span.text, span.style or LINK_STYLE)
+        hyperlink.append(run._r)
+
+
+# 图片宽度（版心宽度）
+IMAGE_WIDTH = Inches(build_image_assets.LAYOUT_WIDTH_INCHES)
+
+
+class DocumentWriter:
+    """python-docx 后端：把 process_markdown_file 解析出的块添加到 Document。"""
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    def heading(self, level, text):
+        # 字体与字号由 HEADING_STYLES 中的样式提供
+        self.doc.add_heading(text, level=0 if level == 1 else min(level, 4))
+
+    def paragraph(self, text, style=None):
+        add_formatted_text(add_paragraph(self.doc, style), text, quote=style == QUOTE_STYLE)
+
+    def blank(self):
+        self.doc.add_paragraph()
+
+    def code_block(self, text):
+        add_paragraph(self.doc, CODE_BLOCK_STYLE).add_run(text)
+
+    def centered(self, text):
+        p = self.doc.add_paragraph(text)
+        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    def image(self, path, caption=None):
+        p = self.doc.add_paragraph()
+        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        p.add_run().add_picture(str(path), width=IMAGE_WIDTH)
+        if caption:
+            add_paragraph(self.doc, CAPTION_STYLE, caption)
+
+    def table(self, rows, alignments=()):
+        add_table(self.doc, rows, alignments)
+
+    def page_break(self):
+        self.doc.add_page_break()
+
+
+class StreamingWriter:
+    """流式后端：每个块直接序列化为 WordprocessingML 写入 docx_stream.DocxStream。
+
+    样式、节属性取自 template（与 python-docx 后端相同的 new_document()），
+    输出与 DocumentWriter 一致，但不构建对象树，正文写过即释放。
+    """
+
+    def __init__(self, output_path, template=None):
+        template = template if template is not None else new_document()
+        section = template.sections[-1]
+        block_width = section.page_width - section.left_margin - section.right_margin
+        self.stream = docx_stream.DocxStream(output_path, template)
+        self.table_width = block_width
+
+    def formatted_runs(self, text, quote=False):
+        spans = tokenize_inline(text, quote)
+        if all(span.link is None for span in spans):
+            return spans_xml(spans)
+        parts = []
+        for link, group in groupby(spans, key=lambda span: span.link):
+            runs = spans_xml(tuple(group))
+            if link is None:
+                parts.append(runs)
+            elif link.startswith('#'):
+                parts.append(f'<w:hyperlink w:anchor={docx_stream.quote_attr(link[1:])}>{runs}</w:hyperlink>')
+            else:
+                rel_id = self.stream.hyperlink_rel(link)
+                parts.append(f'<w:hyperlink r:id="{rel_id}">{runs}</w:hyperlink>')
+        return ''.join(parts)
+
+    def heading(self, level, text):
+        style = 'Title' if level == 1 else f'Heading {min(level, 4)}'
+        self.stream.write(docx_stream.paragraph_xml(docx_stream.run_xml(text), style))
+
+    def paragraph(self, text, style=None):
+        self.stream.write(docx_stream.paragraph_xml(self.formatted_runs(text, style == QUOTE_STYLE), style))
+
+    def blank(self):
+        self.stream.write('<w:p/>')
+
+    def code_block(self, text):
+        self.stream.write(docx_stream.paragraph_xml(docx_stream.run_xml(text), CODE_BLOCK_STYLE))
+
+    def centered(self, text):
+        self.stream.write(docx_stream.paragraph_xml(docx_stream.run_xml(text), align='center'))
+
+    def image(self, path, caption=None):
+        drawing = self.stream.drawing_xml(path, IMAGE_WIDTH)
+        self.stream.write(docx_stream.paragraph_xml(f'<w:r>{drawing}</w:r>', align='center'))
+        if caption:
+            self.stream.write(docx_stream.paragraph_xml(docx_stream.run_xml(caption), CAPTION_STYLE))
+
+    def table(self, rows, alignments=()):
+        num_cols = max(len(row) for row in rows)
+        col_width = Emu(self.table_width // num_cols).twips
+        cell_pr = f'<w:tcPr><w:tcW w:type="dxa" w:w="{col_width}"/></w:tcPr>'
+        grid = f'<w:gridCol w:w="{col_width}"/>' * num_cols
+        self.stream.write(
+            f'<w:tbl><w:tblPr><w:tblStyle w:val="{styleId_from_name(TABLE_STYLE)}"/><w:tblW w:type="auto" w:w="0"/>'
+            '<w:tblLook w:firstRow="1" w:lastRow="0" w:firstColumn="1" w:lastColumn="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+            f'</w:tblPr><w:tblGrid>{grid}</w:tblGrid>'
+        )
+        for row in rows:
+            cells = []
+            for col_idx in range(num_cols):
+                text = row[col_idx] if col_idx < len(row) else ''
+                align = alignments[col_idx] if col_idx < len(alignments) else None
+                content = self.formatted_runs(text) if text else ''
+                cells.append(f'<w:tc>{cell_pr}{docx_stream.paragraph_xml(content, align=align)}</w:tc>')
+            self.stream.write('<w:tr>' + ''.join(cells) + '</w:tr>')
+        self.stream.write('</w:tbl>')
+
+    def page_break(self):
+        self.stream.write('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+
+    def close(self):
+        self.stream.close()
+
+    def abort(self):
+        self.stream.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
         else:
-            run = paragraph.add_run(part)
-            set_chinese_font(run, font_size=11)
+            self.abort()
 
 
-def process_markdown_file(md_path, doc, images_dir):
-    """处理单个 Markdown 文件"""
+@lru_cache(maxsize=4096)
+def spans_xml(spans):
+    """一组 Span 对应的 run（按 Span 元组缓存）；链接内未加格式的文字用链接样式。"""
+    return ''.join(docx_stream.run_xml(span.text, span.style or (LINK_STYLE if span.link else None)) for span in spans)
+
+
+def process_markdown_file(md_path, doc, images_dir, image_assets=None):
+    """处理单个 Markdown 文件
+
+    doc 为 python-docx 的 Document，或 DocumentWriter / StreamingWriter。
+    image_assets 为 {原图绝对路径: 派生图路径}，提供时嵌入缩放压缩后的派生图。
+    """
+    writer = DocumentWriter(doc) if isinstance(doc, DocumentObject) else doc
     with open(md_path, 'r', encoding='utf-8') as f:
         content = f.read()
     
@@ -145,6 +602,7 @@ def process_markdown_file(md_path, doc, images_dir):
     in_table = False
     in_code_block = False
     table_data = []
+    table_alignments = []
     code_lines = []
     
     i = 0
@@ -158,12 +616,7 @@ def process_markdown_file(md_path, doc, images_dir):
         if result == 'code_block_toggle':
             if in_code_block and code_lines:
                 # 结束代码块，添加到文档
-                p = doc.add_paragraph()
-                p.paragraph_format.left_indent = Cm(1)
-                for code_line in code_lines:
-                    run = p.add_run(code_line + '\n')
-                    run.font.name = 'Consolas'
-                    run.font.size = Pt(9)
+                writer.code_block('\n'.join(code_lines) + '\n')
                 code_lines = []
             in_code_block = in_code_block_new
             i += 1
@@ -179,37 +632,21 @@ def process_markdown_file(md_path, doc, images_dir):
         # 表格处理
         if in_table and not in_table_new and table_data:
             # 表格结束，创建表格
-            if len(table_data) > 0:
-                num_cols = len(table_data[0])
-                table = doc.add_table(rows=len(table_data), cols=num_cols)
-                table.style = 'Table Grid'
-                for row_idx, row_data in enumerate(table_data):
-                    for col_idx, cell_text in enumerate(row_data):
-                        if col_idx < num_cols:
-                            cell = table.cell(row_idx, col_idx)
-                            cell.text = ''
-                            p = cell.paragraphs[0]
-                            add_formatted_text(p, cell_text)
-                doc.add_paragraph()  # 表格后空行
+            writer.table(table_data, table_alignments)
+            writer.blank()  # 表格后空行
             table_data = []
+            table_alignments = []
         
         in_table = in_table_new
         in_code_block = in_code_block_new
         
         if result is None:
-            doc.add_paragraph()
+            writer.blank()
             i += 1
             continue
         
         if result[0] == 'heading':
-            level, text = result[1], result[2]
-            if level == 1:
-                p = doc.add_heading(text, level=0)
-            else:
-                p = doc.add_heading(text, level=min(level, 4))
-            # 设置标题字体
-            for run in p.runs:
-                set_chinese_font(run, font_size=16 - level * 2 if level < 4 else 11)
+            writer.heading(result[1], result[2])
         
         elif result[0] == 'image':
             alt_text, img_path = result[1], result[2]
@@ -219,109 +656,148 @@ def process_markdown_file(md_path, doc, images_dir):
                 full_img_path = os.path.join(os.path.dirname(md_path), img_path)
             
             if os.path.exists(full_img_path):
-                p = doc.add_paragraph()
-                p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                run = p.add_run()
-                run.add_picture(full_img_path, width=Inches(5.5))
-                if alt_text:
-                    cap = doc.add_paragraph(alt_text)
-                    cap.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    cap.runs[0].italic = True
-                    set_chinese_font(cap.runs[0], font_size=9)
+                if image_assets:
+                    full_img_path = str(image_assets.get(Path(full_img_path).resolve(), full_img_path))
+                writer.image(full_img_path, alt_text)
             else:
-                p = doc.add_paragraph(f'[图片: {img_path}]')
-                p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                writer.centered(f'[图片: {img_path}]')
         
         elif result[0] == 'table_row':
             table_data.append(result[1])
         
         elif result[0] == 'table_separator':
-            pass  # 忽略分隔行
+            table_alignments = result[1]
         
         elif result[0] == 'bullet':
-            p = doc.add_paragraph(style='List Bullet')
-            add_formatted_text(p, result[1])
+            writer.paragraph(result[1], BULLET_STYLE)
         
         elif result[0] == 'numbered':
-            p = doc.add_paragraph(style='List Number')
-            add_formatted_text(p, result[1])
+            writer.paragraph(result[1], NUMBER_STYLE)
         
         elif result[0] == 'quote':
-            p = doc.add_paragraph()
-            p.paragraph_format.left_indent = Cm(1)
-            p.paragraph_format.first_line_indent = Cm(0)
-            add_formatted_text(p, result[1])
-            for run in p.runs:
-                run.italic = True
+            writer.paragraph(result[1], QUOTE_STYLE)
         
         elif result[0] == 'hr':
-            p = doc.add_paragraph('─' * 50)
-            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            writer.centered('─' * 50)
         
         elif result[0] == 'paragraph':
-            p = doc.add_paragraph()
-            add_formatted_text(p, result[1])
+            writer.paragraph(result[1])
         
         i += 1
     
     # 处理文件末尾的表格
     if table_data:
-        num_cols = len(table_data[0])
-        table = doc.add_table(rows=len(table_data), cols=num_cols)
-        table.style = 'Table Grid'
-        for row_idx, row_data in enumerate(table_data):
-            for col_idx, cell_text in enumerate(row_data):
-                if col_idx < num_cols:
-                    cell = table.cell(row_idx, col_idx)
-                    cell.text = ''
-                    p = cell.paragraphs[0]
-                    add_formatted_text(p, cell_text)
+        writer.table(table_data, table_alignments)
 
 
-def main():
-    """主函数"""
-    base_dir = Path('/Users/max/cursor-project/ai-agent-book/manuscript')
-    images_dir = base_dir / 'images'
-    output_path = base_dir / 'AI智能体工作流_前言及前四章.docx'
-    
-    # 要处理的文件列表
-    md_files = [
-        '00-前言.md',
-        '01-第01章.md',
-        '02-第02章.md',
-        '03-第03章.md',
-        '04-第04章.md',
-    ]
-    
-    # 创建文档
+def new_document():
+    """创建带样式与页边距的空白文档（两种后端共用）。"""
     doc = Document()
     create_document_styles(doc)
-    
-    # 设置页面边距
-    sections = doc.sections
-    for section in sections:
+    for section in doc.sections:
         section.top_margin = Cm(2.54)
         section.bottom_margin = Cm(2.54)
         section.left_margin = Cm(3.17)
         section.right_margin = Cm(3.17)
+    return doc
+
+
+def chapter_files(base_dir=MANUSCRIPT_DIR, last_chapter=None):
+    """扫描 base_dir，按章节号返回前言与各章文件；last_chapter 限定最后一章。"""
+    files = []
+    for path in base_dir.glob('*.md'):
+        match = CHAPTER_FILE_RE.fullmatch(path.name)
+        if match and (last_chapter is None or int(match.group(1)) <= last_chapter):
+            files.append(path)
+    return sorted(files)
+
+
+def render_chapter(md_path, output_path, images_dir, image_assets=None, backend='docx'):
+    """把一章单独渲染为一个 docx 片段（在子进程中运行）。"""
+    if backend == 'stream':
+        with StreamingWriter(output_path) as writer:
+            process_markdown_file(str(md_path), writer, str(images_dir), image_assets)
+    else:
+        doc = new_document()
+        process_markdown_file(str(md_path), doc, str(images_dir), image_assets)
+        doc.save(str(output_path))
+    return output_path
+
+
+def _render_chapter_job(job):
+    return render_chapter(*job)
+
+
+def export_chapters(md_files, output_path, images_dir, image_assets=None, backend='docx', jobs=1):
+    """导出 md_files 到 output_path，章与章之间分页。
+
+    jobs > 1 时每章在单独的进程中渲染为 docx 片段，再由 merge_docx 按顺序拼接，
+    拼接时重新分配图片关系、编号与图片 ID，并在片段之间插入分页符。
+    """
+    if jobs > 1 and len(md_files) > 1:
+        with tempfile.TemporaryDirectory(prefix='export_to_word-') as tmp_dir:
+            work = [
+                (md_path, Path(tmp_dir) / f'{idx:02d}.docx', images_dir, image_assets, backend)
+                for idx, md_path in enumerate(md_files)
+            ]
+            fragments = []
+            with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+                for md_path, fragment in zip(md_files, pool.map(_render_chapter_job, work)):
+                    print(f'处理: {md_path.name}')
+                    fragments.append(fragment)
+            merge_docx.merge_docx(fragments, Path(output_path), page_breaks=True)
+        return
     
-    # 处理每个文件
-    for idx, md_file in enumerate(md_files):
-        md_path = base_dir / md_file
-        if md_path.exists():
-            print(f'处理: {md_file}')
-            process_markdown_file(str(md_path), doc, str(images_dir))
-            
-            # 在章节之间添加分页符（除了最后一章）
-            if idx < len(md_files) - 1:
-                doc.add_page_break()
-        else:
-            print(f'文件不存在: {md_file}')
+    if backend == 'stream':
+        with StreamingWriter(output_path) as writer:
+            write_chapters(writer, md_files, images_dir, image_assets)
+    else:
+        doc = new_document()
+        write_chapters(DocumentWriter(doc), md_files, images_dir, image_assets)
+        doc.save(str(output_path))
+
+
+def write_chapters(writer, md_files, images_dir, image_assets=None):
+    """把 md_files 依次写入 writer（DocumentWriter 或 StreamingWriter），章与章之间分页。"""
+    for idx, md_path in enumerate(md_files):
+        print(f'处理: {md_path.name}')
+        process_markdown_file(str(md_path), writer, str(images_dir), image_assets)
+        # 在章节之间添加分页符（除了最后一章）
+        if idx < len(md_files) - 1:
+            writer.page_break()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='将 Markdown 章节导出为 Word 文档')
+    parser.add_argument('--backend', choices=('docx', 'stream'), default='docx',
+                        help='docx：python-docx 对象模型；stream：边解析边写入 document.xml，内存占用小、速度快')
+    parser.add_argument('--last-chapter', type=int, default=None, help='只导出前言至第 N 章（默认全部）')
+    parser.add_argument('--output', '-o', type=Path, default=None, help='输出路径（默认在 manuscript/ 下）')
+    parser.add_argument('--jobs', '-j', type=int, default=0, help='并行渲染章节的进程数，0 表示使用全部 CPU 核心')
+    args = parser.parse_args()
+    
+    images_dir = MANUSCRIPT_DIR / 'images'
+    md_files = chapter_files(MANUSCRIPT_DIR, args.last_chapter)
+    if not md_files:
+        print(f'{MANUSCRIPT_DIR} 下没有章节文件')
+        return 1
+    if args.output is not None:
+        output_path = args.output
+    elif args.last_chapter is None:
+        output_path = MANUSCRIPT_DIR / 'AI智能体工作流_全书.docx'
+    else:
+        output_path = MANUSCRIPT_DIR / f'AI智能体工作流_前言至第{args.last_chapter:02d}章.docx'
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    
+    # 预先并行生成印刷版派生图（已缓存的直接复用）
+    image_sources = [p for p in images_dir.glob('*') if p.suffix.lower() in build_image_assets.IMAGE_EXTENSIONS]
+    image_assets = build_image_assets.build_assets(image_sources, 'print')
     
-    # 保存文档
-    doc.save(str(output_path))
+    export_chapters(md_files, output_path, images_dir, image_assets, args.backend, jobs)
     print(f'\n导出完成: {output_path}')
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    exit(main())
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""各脚本共用的文件写入工具：原子写入、按内容哈希判断是否需要改写。"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+
+
+def file_digest(path: Path) -> bytes:
+    """文件内容的 sha256（分块读取，内存占用与文件大小无关）。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def has_content(path: Path, size: int, digest: bytes) -> bool:
+    """path 的内容是否为给定大小与 sha256 的数据；先比较字节数，相同再计算哈希。"""
+    try:
+        return path.stat().st_size == size and file_digest(path) == digest
+    except FileNotFoundError:
+        return False
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    """先写临时文件再原子替换，避免读者看到写了一半的文件。"""
+    tmp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_file.write_text(text, encoding="utf-8")
+        os.replace(tmp_file, path)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def write_text_if_changed(path: Path, text: str) -> bool:
+    """内容与现有文件不同时才（原子地）写入，返回是否写入。
+
+    内容未变时不动文件，mtime 保持不变，下游的增量步骤（编辑器重载、导出缓存）
+    也就不会被无谓地触发。
+    """
+    data = text.encode("utf-8")
+    if has_content(path, len(data), hashlib.sha256(data).digest()):
+        return False
+    write_text_atomic(path, text)
+    return True
@@ -1,31 +1,317 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""将直双引号 "..." 替换为弯双引号 "..."，避免导出 Word 时显示成两个右引号。"""
+"""将直双引号 "..." 替换为弯双引号 "..."，避免导出 Word 时显示成两个右引号。
 
+按 Markdown 结构单遍扫描：围栏代码块、行内代码、链接/图片目标、HTML 标签与自动
+链接、反斜杠转义中的引号保持原样；引号只在同一段落（空行分隔）内配对，段落里
+落单的引号不改。替换一对一、不改变字符数，线性时间，可逐行流式处理。
+
+处理过的文件记录在 .cache/fix_quotes.json（路径 → mtime、大小、处理结果的哈希），
+mtime 与大小都没变的文件直接跳过、不再打开；其余文件并行处理。
+--check 只检查不改写：仍有直双引号时以非零状态退出，可用作构建前的门禁。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-MANUSCRIPT = Path(__file__).resolve().parent.parent / "manuscript"
+from file_utils import write_text_atomic
+
+ROOT = Path(__file__).resolve().parent.parent
+MANUSCRIPT = ROOT / "manuscript"
+INDEX_FILE = ROOT / ".cache" / "fix_quotes.json"
+# 替换逻辑版本号：修改 fix_quotes 的行为时递增，使索引失效。
+FIX_VERSION = "3"
 # 弯引号：左 " U+201C，右 " U+201D
 LEFT, RIGHT = "\u201c", "\u201d"
+CHAPTER_PREFIXES = tuple(f"{i:02d}" for i in range(14))
+
+
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# 扫描时只需停在这些字符上，其余正文整段跳过
+SPECIAL_RE = re.compile(r'[\\`\]<"]')
+PAREN_RE = re.compile(r"[()]|\n\n")
+# HTML 标签与自动链接的开头：与 CommonMark 一样只认 ASCII 字母、/ 与 !，
+# 中文正文里的「<中」不算（str.isalpha() 对汉字也为真）
+TAG_START_RE = re.compile(r"<[A-Za-z/!]")
+
+
+def scan_paragraph(text: str) -> tuple[list[tuple[int, int]], int]:
+    """扫描一个段落，返回 (可配对的引号位置对, 正文中的直双引号总数)。"""
+    pairs: list[tuple[int, int]] = []
+    prose = 0
+    opening = -1
+    unclosed_ticks: set[int] = set()  # 已知之后再无同长闭合的反引号串长度
+    parens: dict[int, int] | None = None  # 左括号位置 → 配对右括号之后的位置，首次遇到 ]( 时才计算
+    n = len(text)
+    i = 0
+    while True:
+        m = SPECIAL_RE.search(text, i)
+        if m is None:
+            break
+        i = m.start()
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "`":
+            j = i
+            while j < n and text[j] == "`":
+                j += 1
+            end = -1 if j - i in unclosed_ticks else closing_ticks(text, j, j - i)
+            if end < 0:
+                unclosed_ticks.add(j - i)
+                i = j
+            else:
+                i = end
+            continue
+        if c == "]" and text.startswith("(", i + 1):
+            if parens is None:
+                parens = match_parens(text)
+            end = parens.get(i + 1, -1)
+            i = end if end > 0 else i + 1
+            continue
+        if c == "<" and TAG_START_RE.match(text, i):
+            end = text.find(">", i + 1)
+            if end > 0:
+                i = end + 1
+                continue
+        if c == '"':
+            prose += 1
+            if opening < 0:
+                opening = i
+            else:
+                pairs.append((opening, i))
+                opening = -1
+        i += 1
+    return pairs, prose
+
+
+def closing_ticks(text: str, start: int, length: int) -> int:
+    """从 start 起找恰好 length 个反引号组成的闭合串，返回其后的位置；没有则返回 -1。"""
+    ticks = "`" * length
+    k = text.find(ticks, start)
+    while k >= 0:
+        end = k + length
+        if end < len(text) and text[end] == "`":
+            while end < len(text) and text[end] == "`":
+                end += 1
+            k = text.find(ticks, end)
+            continue
+        return end
+    return -1
+
+
+def match_parens(text: str) -> dict[int, int]:
+    """一次扫描为每个左括号找配对的右括号，返回 {左括号位置: 右括号之后的位置}。
+
+    与从每个左括号起逐个计数深度的结果相同，但整段只扫一遍：段落中有多个
+    不闭合的 ]( 时也不会对每个都扫到段尾。空行处重新开始配对。
+    """
+    matches: dict[int, int] = {}
+    stack: list[int] = []
+    for m in PAREN_RE.finditer(text):
+        c = m.group()
+        if c == "(":
+            stack.append(m.start())
+        elif c == ")":
+            if stack:
+                matches[stack.pop()] = m.end()
+        else:
+            stack.clear()
+    return matches
+
+
+class QuoteFixer:
+    """逐行喂入 Markdown，按段落产出替换后的文本；prose_quotes 统计正文中的直双引号。"""
+
+    def __init__(self):
+        self.fence: str | None = None
+        self.paragraph: list[str] = []
+        self.prose_quotes = 0
+        self.unpaired = 0
+
+    def feed(self, line: str) -> str:
+        if self.fence is not None:
+            stripped = line.strip()
+            if stripped.startswith(self.fence) and not stripped.strip(self.fence[0]):
+                self.fence = None
+            return line
+        m = FENCE_RE.match(line)
+        if m:
+            out = self.flush()
+            self.fence = m.group(1)
+            return out + line
+        if not line.strip():
+            return self.flush() + line
+        self.paragraph.append(line)
+        return ""
+
+    def flush(self) -> str:
+        if not self.paragraph:
+            return ""
+        text = "".join(self.paragraph)
+        self.paragraph = []
+        pairs, prose = scan_paragraph(text)
+        self.prose_quotes += prose
+        self.unpaired += prose - 2 * len(pairs)
+        if not pairs:
+            return text
+        chars = list(text)
+        for left, right in pairs:
+            chars[left] = LEFT
+            chars[right] = RIGHT
+        return "".join(chars)
+
+    def close(self) -> str:
+        return self.flush()
+
+
+def iter_fix_quotes(lines):
+    """流式版本：lines 为带换行符的行，逐段产出替换后的文本。"""
+    fixer = QuoteFixer()
+    for line in lines:
+        out = fixer.feed(line)
+        if out:
+            yield out
+    out = fixer.close()
+    if out:
+        yield out
 
 
 def fix_quotes(text: str) -> str:
-    # 将 "内容" 替换为 "内容"（按配对替换）
-    return re.sub(r'"([^"]*)"', f"{LEFT}\\1{RIGHT}", text)
+    """将段落内成对的 "内容" 替换为 “内容”；字符数不变。
 
+    >>> fix_quotes('见 <a href="x">"链接"</a>')
+    '见 <a href="x">“链接”</a>'
+    >>> fix_quotes('符号 <中 "引号" 之后 -> "再"')
+    '符号 <中 “引号” 之后 -> “再”'
+    """
+    return "".join(iter_fix_quotes(text.splitlines(keepends=True)))
 
-def main():
-    files = list(MANUSCRIPT.glob("*.md"))
-    files = [f for f in files if f.name.startswith(("00", "01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12", "13")) or f.name == "full-book.md"]
-    for path in sorted(files):
-        s = path.read_text(encoding="utf-8")
+
+def straight_quotes(text: str) -> int:
+    """返回正文中（代码、链接目标与 HTML 之外）的直双引号个数。"""
+    fixer = QuoteFixer()
+    for line in text.splitlines(keepends=True):
+        fixer.feed(line)
+    fixer.close()
+    return fixer.prose_quotes
+
+
+def manuscript_files() -> list[Path]:
+    files = [f for f in MANUSCRIPT.glob("*.md") if f.name.startswith(CHAPTER_PREFIXES) or f.name == "full-book.md"]
+    return sorted(files)
+
+
+def load_index() -> dict:
+    try:
+        index = json.loads(INDEX_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return index.get("files", {}) if index.get("version") == FIX_VERSION else {}
+
+
+def save_index(files: dict) -> None:
+    INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
+    write_text_atomic(INDEX_FILE, json.dumps({"version": FIX_VERSION, "files": files}, ensure_ascii=False, indent=2))
+
+
+def is_indexed(path: Path, entry: dict | None) -> bool:
+    if entry is None:
+        return False
+    st = path.stat()
+    return entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size
+
+
+def process_file(path: Path, check: bool = False, previous: dict | None = None) -> tuple[bool, dict]:
+    """处理单个文件，返回 (是否改写, 索引项)；check 为 True 时只统计不改写。
+
+    previous 为该文件的旧索引项：内容哈希与上次处理结果相同（只是 mtime 变了）时
+    不必重新替换。
+    """
+    data = path.read_bytes()
+    s = data.decode("utf-8")
+    if check or (previous is not None and previous["sha256"] == hashlib.sha256(data).hexdigest()):
+        new_s = s
+    else:
         new_s = fix_quotes(s)
-        if new_s != s:
-            path.write_text(new_s, encoding="utf-8")
-            print(f"已处理: {path.name}")
-    print("完成。")
+    changed = new_s != s
+    if changed:
+        write_text_atomic(path, new_s)
+        data = new_s.encode("utf-8")
+    st = path.stat()
+    entry = {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "straight_quotes": straight_quotes(new_s),
+    }
+    return changed, entry
+
+
+def _process_job(job: tuple[Path, bool, dict | None]) -> tuple[bool, dict]:
+    return process_file(*job)
+
+
+def run(files: list[Path], check: bool = False, jobs: int = 0, use_index: bool = True) -> dict[str, dict]:
+    """处理 files，返回 {文件名: 索引项}（额外带 changed、skipped 两个键）。"""
+    index = load_index() if use_index else {}
+    results: dict[str, dict] = {}
+    pending: list[Path] = []
+    for path in files:
+        entry = index.get(path.name)
+        if is_indexed(path, entry):
+            results[path.name] = {**entry, "changed": False, "skipped": True}
+        else:
+            pending.append(path)
+
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    work = [(path, check, index.get(path.name)) for path in pending]
+    if jobs <= 1 or len(work) <= 1:
+        outcomes = [_process_job(job) for job in work]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+            outcomes = list(pool.map(_process_job, work))
+
+    for path, (changed, entry) in zip(pending, outcomes):
+        results[path.name] = {**entry, "changed": changed, "skipped": False}
+        # 只检查时文件没被处理过，不能记为「已处理」
+        if not check:
+            index[path.name] = entry
+    if use_index and not check and pending:
+        save_index(index)
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="将稿件中的直双引号替换为弯双引号")
+    parser.add_argument("--check", action="store_true", help="只检查，仍有直双引号时以非零状态退出")
+    parser.add_argument("--jobs", "-j", type=int, default=0, help="并行进程数，0 表示使用全部 CPU 核心")
+    parser.add_argument("--no-index", action="store_true", help="忽略索引，处理全部文件")
+    args = parser.parse_args(argv)
+
+    results = run(manuscript_files(), check=args.check, jobs=args.jobs, use_index=not args.no_index)
+    remaining = 0
+    for name, result in results.items():
+        if result["changed"]:
+            print(f"已处理: {name}")
+        if result["straight_quotes"]:
+            remaining += result["straight_quotes"]
+            print(f"仍有直双引号: {name}（{result['straight_quotes']} 个）")
+    skipped = sum(result["skipped"] for result in results.values())
+    print(f"完成。共 {len(results)} 个文件，{skipped} 个未变化已跳过。")
+    if args.check and remaining:
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
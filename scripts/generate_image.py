@@ -1,73 +1,39 @@
-import os
 import argparse
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
-from PIL import Image
-import io
+import image_manifest
+from image_providers import GeminiProvider, ProviderError
+from model_catalog import validate_model
 
-load_dotenv()
 
-def generate_image(prompt, output_file, model_name="gemini-3-pro-image-preview"):
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        print("Error: GOOGLE_API_KEY not found in environment variables.")
-        return
-
-    client = genai.Client(api_key=api_key)
+def generate_image(prompt, output_file, model_name="gemini-3-pro-image-preview", max_width=None, check_model=True):
+    """Generate one image; returns a timing dict, or None if nothing was saved."""
+    provider = GeminiProvider()
     
     print(f"Generating image for prompt: '{prompt}'...")
     print(f"Using model: {model_name}")
     
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[prompt],
-        )
-        
-        image_saved = False
-        
-        if response.parts:
-            for part in response.parts:
-                if part.inline_data:
-                    # Try using as_image() if available, otherwise handle bytes manually
-                    if hasattr(part, 'as_image'):
-                        try:
-                            img = part.as_image()
-                            img.save(output_file)
-                            print(f"Success! Image saved to {output_file}")
-                            image_saved = True
-                            break
-                        except Exception as e:
-                            print(f"Error using as_image(): {e}")
-                    
-                    # Fallback to direct bytes handling
-                    if not image_saved:
-                        try:
-                            img_data = part.inline_data.data
-                            # img_data might be bytes or base64 string depending on SDK version
-                            # usually it's bytes in the new SDK
-                            img = Image.open(io.BytesIO(img_data))
-                            img.save(output_file)
-                            print(f"Success! Image saved to {output_file}")
-                            image_saved = True
-                            break
-                        except Exception as e:
-                            print(f"Error processing inline data bytes: {e}")
-                            
-        if not image_saved:
-            print("No image found in response.")
-            # print(response) # Debugging
-
-    except Exception as e:
+        if check_model:
+            validate_model(provider, model_name)
+        timing = provider.generate(prompt, output_file, model_name, max_width=max_width)
+    except ProviderError as e:
         print(f"An error occurred: {e}")
         print("Tip: Verify your API key and model availability.")
+        return
+
+    mode = "decoded + re-encoded" if timing["decoded"] else f"raw {timing['source']}"
+    print(f"Success! Image saved to {output_file} ({mode})")
+    print(f"Timing: API {timing['api_seconds']:.2f}s, write {timing['write_seconds']:.3f}s")
+    if image_manifest.record_image(prompt, {"provider": provider.name, "model": model_name, "size": None}, output_file):
+        print(f"Recorded in {image_manifest.MANIFEST_FILE.name}")
+    return timing
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate image using Google Gemini 2.5 Flash Image")
     parser.add_argument("prompt", help="Text prompt for image generation")
     parser.add_argument("--output", "-o", default="generated_image.png", help="Output filename")
     parser.add_argument("--model", "-m", default="gemini-3-pro-image-preview", help="Model name to use")
+    parser.add_argument("--max-width", type=int, default=None, help="Downscale to this width (forces decode/re-encode)")
+    parser.add_argument("--no-model-check", action="store_true", help="Skip validating --model against the model catalog")
     
     args = parser.parse_args()
-    generate_image(args.prompt, args.output, args.model)
+    generate_image(args.prompt, args.output, args.model, args.max_width, not args.no_model_check)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Provenance manifest for manuscript/images.
+
+manuscript/images/manifest.json maps each generated image to the hash of the
+prompt text and generation parameters (provider, model, size) that produced
+it. batch_generate_images.py records every image it generates, and
+generate_image.py / generate_image_openai.py record images saved into
+manuscript/images; the batch tool uses the manifest to regenerate only images
+whose prompt or parameters changed. Run this script for a report of stale, untracked and
+orphaned images and of prompts that have no image yet.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from file_utils import file_digest, write_text_atomic
+
+ROOT = Path(__file__).resolve().parent.parent
+IMAGES_DIR = ROOT / "manuscript" / "images"
+MANIFEST_FILE = IMAGES_DIR / "manifest.json"
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+
+
+def prompt_hash(prompt: str, params: dict) -> str:
+    payload = json.dumps({"prompt": prompt, **params}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path: Path = MANIFEST_FILE) -> dict[str, dict]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_manifest(manifest: dict[str, dict], path: Path = MANIFEST_FILE) -> None:
+    write_text_atomic(path, json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True) + "\n")
+
+
+def record(manifest: dict[str, dict], job, params: dict, image_path: Path) -> None:
+    manifest[job.filename] = {
+        "chapter": job.chapter,
+        "title": job.title,
+        "prompt_hash": prompt_hash(job.prompt, params),
+        "params": params,
+        "sha256": file_digest(image_path).hex(),
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def record_image(prompt: str, params: dict, image_path: Path) -> bool:
+    """Record an image saved by one of the single-image CLIs (generate_image*.py).
+
+    Only images written to manuscript/images, or to another directory that
+    already has a manifest, are recorded; returns whether an entry was written.
+    The chapter and title come from the prompts file entry with the same
+    filename, if there is one. The hash is of the prompt actually used, so an
+    image made from an edited prompt shows up as stale against the prompts file.
+    """
+    from batch_generate_images import PromptJob, load_jobs
+
+    image_path = Path(image_path)
+    manifest_file = image_path.parent / MANIFEST_FILE.name
+    if image_path.parent.resolve() != IMAGES_DIR.resolve() and not manifest_file.exists():
+        return False
+    job = next((job for job in load_jobs() if job.filename == image_path.name), None)
+    job = PromptJob(job.chapter if job else 0, job.title if job else "", prompt, image_path.name)
+    manifest = load_manifest(manifest_file)
+    record(manifest, job, params, image_path)
+    save_manifest(manifest, manifest_file)
+    return True
+
+
+def is_current(manifest: dict[str, dict], job, params: dict, output_dir: Path = IMAGES_DIR) -> bool:
+    """True if the image exists and was generated from this exact prompt and parameters.
+
+    Images that exist but have no manifest entry (generated before the manifest
+    existed) also count as current; use --adopt to record them.
+    """
+    if not (output_dir / job.filename).exists():
+        return False
+    entry = manifest.get(job.filename)
+    return entry is None or entry.get("prompt_hash") == prompt_hash(job.prompt, params)
+
+
+def build_report(jobs: list, manifest: dict[str, dict], params: dict | None, output_dir: Path = IMAGES_DIR) -> dict[str, list[str]]:
+    """Classify every prompt and image.
+
+    With params=None, staleness is judged against the parameters recorded in
+    each entry, i.e. only prompt edits count as changes.
+    """
+    report: dict[str, list[str]] = {"current": [], "stale": [], "untracked": [], "missing": [], "orphaned": []}
+    names = set()
+    for job in jobs:
+        names.add(job.filename)
+        entry = manifest.get(job.filename)
+        if not (output_dir / job.filename).exists():
+            report["missing"].append(job.filename)
+        elif entry is None:
+            report["untracked"].append(job.filename)
+        elif entry["prompt_hash"] == prompt_hash(job.prompt, params if params is not None else entry["params"]):
+            report["current"].append(job.filename)
+        else:
+            report["stale"].append(job.filename)
+
+    for path in sorted(output_dir.iterdir()):
+        if path.suffix.lower() in IMAGE_EXTENSIONS and path.name not in names:
+            report["orphaned"].append(path.name)
+    return report
+
+
+if __name__ == "__main__":
+    from batch_generate_images import load_jobs
+
+    parser = argparse.ArgumentParser(description="Report on manuscript/images against the prompts files")
+    parser.add_argument("--adopt", action="store_true", help="Record untracked existing images under the given parameters")
+    parser.add_argument("--provider", default="gemini", help="Provider recorded by --adopt")
+    parser.add_argument("--model", default="gemini-3-pro-image-preview", help="Model recorded by --adopt")
+    parser.add_argument("--size", default=None, help="Size recorded by --adopt (openai provider only)")
+    args = parser.parse_args()
+
+    jobs = load_jobs()
+    manifest = load_manifest()
+    report = build_report(jobs, manifest, None)
+
+    if args.adopt and report["untracked"]:
+        params = {"provider": args.provider, "model": args.model, "size": args.size}
+        by_name = {job.filename: job for job in jobs}
+        for name in report["untracked"]:
+            record(manifest, by_name[name], params, IMAGES_DIR / name)
+        save_manifest(manifest)
+        print(f"Adopted {len(report['untracked'])} untracked images into {MANIFEST_FILE}")
+        report = build_report(jobs, manifest, None)
+
+    for key in ("stale", "untracked", "missing", "orphaned"):
+        if report[key]:
+            print(f"\n[{key}] {len(report[key])}")
+            for name in report[key]:
+                print(f"  - {name}")
+    print(
+        f"\n{len(jobs)} prompts: {len(report['current'])} current, {len(report['stale'])} stale, "
+        f"{len(report['untracked'])} untracked, {len(report['missing'])} missing; {len(report['orphaned'])} orphaned images"
+    )
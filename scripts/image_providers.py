@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Image-generation backends behind one interface.
+
+Both providers expose the same methods:
+
+- list_models() -> list of {"id": ..., "methods": [...]}
+- generate(prompt, output_file, model=None, size=None, max_width=None) -> timing dict
+  (size is used by openai, max_width by gemini)
+
+Client setup (API key, base URL, one cached client per key/URL) and file
+writing (temp file, truncation check, atomic rename) live here once. Every
+failure is raised as ProviderError so callers handle both backends alike.
+
+The base URL of either backend can be overridden, which is how
+mock_image_server.py stands in for both APIs offline:
+
+- gemini: GOOGLE_API_KEY, GOOGLE_GEMINI_BASE_URL
+- openai: OPENAI_API_KEY, OPENAI_BASE_URL
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DOWNLOAD_TIMEOUT = (10, 120)  # (connect, read) seconds
+CHUNK_SIZE = 64 * 1024
+B64_CHUNK = 4 * 16 * 1024
+B64_WHITESPACE = str.maketrans("", "", " \t\r\n\v\f")
+
+# Output extension -> MIME type whose bytes can be written as-is.
+EXTENSION_MIME = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+class ProviderError(Exception):
+    pass
+
+
+def get_session():
+    """Shared keep-alive session so batch downloads reuse pooled connections."""
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({"GET"}))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def cached_client(key, factory):
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def check_image_file(path):
+    """Reject empty or visibly truncated PNG/JPEG files."""
+    size = os.path.getsize(path)
+    if size == 0:
+        raise ProviderError("image is empty")
+    with open(path, "rb") as f:
+        head = f.read(8)
+        f.seek(max(0, size - 12))
+        tail = f.read()
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and not tail.endswith(b"IEND\xaeB`\x82"):
+        raise ProviderError("PNG is truncated (missing IEND chunk)")
+    if head.startswith(b"\xff\xd8") and not tail.endswith(b"\xff\xd9"):
+        raise ProviderError("JPEG is truncated (missing EOI marker)")
+
+
+def write_atomically(output_file, write):
+    """Call write(f) on a temp file next to output_file, verify it, then rename into place."""
+    directory = os.path.dirname(output_file) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_file = os.path.join(directory, f".{os.path.basename(output_file)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_file, "wb") as f:
+            write(f)
+        check_image_file(tmp_file)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def download_image(url, output_file):
+    """Stream url to output_file in chunks; memory use does not grow with image size."""
+    def write(f):
+        with get_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            expected = response.headers.get("Content-Length")
+            written = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+            if expected and not response.headers.get("Content-Encoding") and written != int(expected):
+                raise ProviderError(f"download truncated: {written} of {expected} bytes")
+
+    write_atomically(output_file, write)
+
+
+def save_b64_image(b64_data, output_file):
+    """Decode base64 image data slice by slice instead of materialising the full bytes.
+
+    Whitespace (line-wrapped payloads, a trailing newline) may appear anywhere, so
+    each slice is cleaned first and any characters beyond a multiple of 4 are
+    carried into the next slice.
+    """
+    def write(f):
+        carry = ""
+        for start in range(0, len(b64_data), B64_CHUNK):
+            chunk = carry + b64_data[start:start + B64_CHUNK].translate(B64_WHITESPACE)
+            usable = len(chunk) - len(chunk) % 4
+            f.write(base64.b64decode(chunk[:usable]))
+            carry = chunk[usable:]
+        if carry:
+            f.write(base64.b64decode(carry))
+
+    write_atomically(output_file, write)
+
+
+def save_image_bytes(data, mime_type, output_file, max_width=None):
+    """Save image bytes to output_file; returns True if they had to be decoded.
+
+    The bytes are written unchanged when mime_type matches the output
+    extension and no resize is requested. Otherwise the image is decoded with
+    PIL and re-encoded in the format implied by the extension.
+    """
+    extension = os.path.splitext(output_file)[1].lower()
+    wanted_mime = EXTENSION_MIME.get(extension)
+    if max_width is None and wanted_mime is not None and mime_type == wanted_mime:
+        write_atomically(output_file, lambda f: f.write(data))
+        return False
+
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    if max_width is not None and img.width > max_width:
+        img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+    if wanted_mime == "image/jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format=Image.registered_extensions().get(extension, "PNG"))
+    write_atomically(output_file, lambda f: f.write(buffer.getvalue()))
+    return True
+
+
+class GeminiProvider:
+    name = "gemini"
+    default_model = "gemini-3-pro-image-preview"
+
+    def __init__(self, api_key=None, base_url=None):
+        self.api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+        self.base_url = base_url or os.environ.get("GOOGLE_GEMINI_BASE_URL")
+
+    def client(self):
+        if not self.api_key:
+            raise ProviderError("GOOGLE_API_KEY not found in environment variables.")
+
+        def create():
+            from google import genai
+            from google.genai import types
+
+            http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+            return genai.Client(api_key=self.api_key, http_options=http_options)
+
+        return cached_client((self.name, self.api_key, self.base_url), create)
+
+    def list_models(self):
+        try:
+            return [
+                {"id": model.name, "methods": list(getattr(model, "supported_actions", None) or [])}
+                for model in self.client().models.list()
+            ]
+        except ProviderError:
+            raise
+        except Exception as e:
+            raise ProviderError(f"listing models failed: {e}") from e
+
+    def generate(self, prompt, output_file, model=None, size=None, max_width=None):
+        client = self.client()
+        try:
+            started = time.perf_counter()
+            response = client.models.generate_content(model=model or self.default_model, contents=[prompt])
+            api_seconds = time.perf_counter() - started
+        except Exception as e:
+            raise ProviderError(f"generate_content failed: {e}") from e
+
+        for part in response.parts or []:
+            if not part.inline_data:
+                continue
+            data = part.inline_data.data
+            if isinstance(data, str):
+                data = base64.b64decode(data)
+            started = time.perf_counter()
+            decoded = save_image_bytes(data, part.inline_data.mime_type, output_file, max_width)
+            return {
+                "api_seconds": api_seconds,
+                "write_seconds": time.perf_counter() - started,
+                "decoded": decoded,
+                "source": part.inline_data.mime_type,
+            }
+        raise ProviderError("No image found in response.")
+
+
+class OpenAIProvider:
+    name = "openai"
+    default_model = "dall-e-3"
+
+    def __init__(self, api_key=None, base_url=None):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+
+    def client(self):
+        if not self.api_key:
+            raise ProviderError("OPENAI_API_KEY not found in environment variables.")
+
+        def create():
+            from openai import OpenAI
+
+            print(f"Initializing OpenAI client with base_url: {self.base_url if self.base_url else 'default'}")
+            return OpenAI(api_key=self.api_key, base_url=self.base_url)
+
+        return cached_client((self.name, self.api_key, self.base_url), create)
+
+    def list_models(self):
+        try:
+            return [{"id": model.id, "methods": []} for model in self.client().models.list().data]
+        except ProviderError:
+            raise
+        except Exception as e:
+            raise ProviderError(f"listing models failed: {e}") from e
+
+    def generate(self, prompt, output_file, model=None, size=None, max_width=None):
+        client = self.client()
+        try:
+            started = time.perf_counter()
+            response = client.images.generate(
+                model=model or self.default_model,
+                prompt=prompt,
+                size=size or "1024x1024",
+                quality="standard",
+                n=1,
+            )
+            api_seconds = time.perf_counter() - started
+        except Exception as e:
+            raise ProviderError(f"images.generate failed: {e}") from e
+
+        if not response.data:
+            raise ProviderError("No data in response.")
+        item = response.data[0]
+        started = time.perf_counter()
+        try:
+            # Some providers return b64_json instead of url
+            if item.url:
+                download_image(item.url, output_file)
+                source = item.url
+            elif getattr(item, "b64_json", None):
+                save_b64_image(item.b64_json, output_file)
+                source = "base64"
+            else:
+                raise ProviderError("Response has neither an image URL nor b64_json.")
+        except ProviderError:
+            raise
+        except Exception as e:
+            raise ProviderError(f"saving image failed: {e}") from e
+        return {"api_seconds": api_seconds, "write_seconds": time.perf_counter() - started, "decoded": False, "source": source}
+
+
+PROVIDERS = {provider.name: provider for provider in (GeminiProvider, OpenAIProvider)}
+
+
+def get_provider(name, **kwargs):
+    try:
+        return PROVIDERS[name](**kwargs)
+    except KeyError:
+        raise ProviderError(f"unknown provider: {name}") from None
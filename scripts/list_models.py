@@ -1,26 +1,22 @@
-import os
-from google import genai
-from dotenv import load_dotenv
+import argparse
+from image_providers import GeminiProvider, ProviderError
+from model_catalog import catalog_age, load_catalog
 
-load_dotenv()
-
-def list_models():
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        print("Error: GOOGLE_API_KEY not found.")
-        return
-
-    client = genai.Client(api_key=api_key)
-    
+def list_models(refresh=False):
     print("Listing available models...")
     try:
-        # In the new SDK, client.models.list() returns an iterator
-        for model in client.models.list():
-            print(f"- {model.name}")
-            if hasattr(model, 'supported_generation_methods'):
-                print(f"  Methods: {model.supported_generation_methods}")
-    except Exception as e:
+        catalog = load_catalog(GeminiProvider(), refresh=refresh)
+    except ProviderError as e:
         print(f"Error listing models: {e}")
+        return
+
+    print(f"(catalog fetched {catalog_age(catalog) / 60:.0f} min ago; --refresh to update)")
+    for model in catalog["models"].values():
+        print(f"- {model['id']}")
+        if model["methods"]:
+            print(f"  Methods: {model['methods']}")
 
 if __name__ == "__main__":
-    list_models()
+    parser = argparse.ArgumentParser(description="List Gemini models")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cached catalog")
+    list_models(parser.parse_args().refresh)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""把按章分别导出的 docx（pandoc 或 export_to_word）依次合并为一个 docx。
+
+所有片段须使用同一个 reference.docx（或同一套样式）生成。第一个片段作为基底，保留其节属性、
+文档设置与主题；其后各片段的正文依次追加到基底末尾，同时合并：
+
+- 图片等关系与 media 文件（按内容哈希去重、重新命名）
+- 列表编号（w:num 重新编号，缺少的 w:abstractNum 补入）
+- 片段中新增的样式、脚注
+- 书签与 wp:docPr 编号（保证全文唯一）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import posixpath
+import zipfile
+from pathlib import Path
+
+from lxml import etree
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+PIC_NS = "http://schemas.openxmlformats.org/drawingml/2006/picture"
+
+REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+PART_CONTENT_TYPES = {
+    "numbering": "application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml",
+    "footnotes": "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml",
+}
+
+
+def w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+def read_package(path: Path) -> dict[str, bytes]:
+    with zipfile.ZipFile(path) as z:
+        return {name: z.read(name) for name in z.namelist()}
+
+
+def parse(data: bytes) -> etree._Element:
+    return etree.fromstring(data, parser=etree.XMLParser(huge_tree=True, remove_blank_text=False))
+
+
+def rels_name(part_name: str) -> str:
+    directory, name = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", f"{name}.rels")
+
+
+def empty_rels() -> etree._Element:
+    return etree.Element(f"{{{REL_NS}}}Relationships", nsmap={None: REL_NS})
+
+
+class MergedDocx:
+    """基底包与合并过程中需要保持唯一的各类编号。"""
+
+    def __init__(self, base: dict[str, bytes]):
+        self.parts = dict(base)
+        self.xml: dict[str, etree._Element] = {}
+        self.document = self.load("word/document.xml")
+        self.body = self.document.find(w("body"))
+        sect_pr = self.body[-1] if len(self.body) and self.body[-1].tag == w("sectPr") else None
+        self.sect_pr = sect_pr
+        self.content_types = self.load("[Content_Types].xml")
+
+        self.rel_counter = 0
+        self.media: dict[str, str] = {}  # 内容哈希 → media 部件名
+        self.bookmark_names: set[str] = set()
+        self.next_bookmark_id = 0
+        self.next_docpr_id = 0
+        self.next_num_id = 1
+        self.next_footnote_id = 1
+
+        for part_name in ("word/document.xml", "word/footnotes.xml"):
+            if part_name not in self.parts:
+                continue
+            root = self.load(part_name)
+            for el in root.iter(w("bookmarkStart")):
+                self.bookmark_names.add(el.get(w("name")))
+            for el in root.iter(w("bookmarkStart"), w("bookmarkEnd")):
+                self.next_bookmark_id = max(self.next_bookmark_id, int(el.get(w("id"))) + 1)
+            for el in root.iter(f"{{{WP_NS}}}docPr", f"{{{PIC_NS}}}cNvPr"):
+                self.next_docpr_id = max(self.next_docpr_id, int(el.get("id")) + 1)
+            for rel in self.load(rels_name(part_name)).iter(f"{{{REL_NS}}}Relationship"):
+                if rel.get("Type") == REL_TYPE + "image":
+                    media_name = posixpath.normpath(posixpath.join("word", rel.get("Target")))
+                    self.media.setdefault(hashlib.sha256(self.parts[media_name]).hexdigest(), media_name)
+
+        if "word/numbering.xml" in self.parts:
+            for num in self.load("word/numbering.xml").iter(w("num")):
+                self.next_num_id = max(self.next_num_id, int(num.get(w("numId"))) + 1)
+        if "word/footnotes.xml" in self.parts:
+            for note in self.load("word/footnotes.xml").iter(w("footnote")):
+                self.next_footnote_id = max(self.next_footnote_id, int(note.get(w("id"))) + 1)
+
+    def load(self, part_name: str) -> etree._Element:
+        if part_name not in self.xml:
+            if part_name in self.parts:
+                self.xml[part_name] = parse(self.parts[part_name])
+            elif part_name.endswith(".rels"):
+                self.xml[part_name] = empty_rels()
+            else:
+                raise KeyError(part_name)
+        return self.xml[part_name]
+
+    def new_rel_id(self) -> str:
+        self.rel_counter += 1
+        return f"rIdMerged{self.rel_counter}"
+
+    def add_relationship(self, source_part: str, rel_type: str, target: str, external: bool = False) -> str:
+        rels = self.load(rels_name(source_part))
+        rel_id = self.new_rel_id()
+        rel = etree.SubElement(rels, f"{{{REL_NS}}}Relationship")
+        rel.set("Id", rel_id)
+        rel.set("Type", rel_type)
+        rel.set("Target", target)
+        if external:
+            rel.set("TargetMode", "External")
+        return rel_id
+
+    def add_override(self, part_name: str, content_type: str) -> None:
+        override = etree.SubElement(self.content_types, f"{{{CT_NS}}}Override")
+        override.set("PartName", f"/{part_name}")
+        override.set("ContentType", content_type)
+
+    def ensure_part(self, kind: str, fragment: dict[str, bytes]) -> etree._Element:
+        """确保基底包含 numbering/footnotes 部件；缺失时以片段中的同名部件为模板建一个空的。"""
+        part_name = f"word/{kind}.xml"
+        if part_name not in self.parts:
+            root = parse(fragment[part_name])
+            for child in list(root):
+                if kind == "footnotes" and child.get(w("type")) is not None:
+                    continue  # 保留分隔符脚注
+                root.remove(child)
+            self.parts[part_name] = b""
+            self.xml[part_name] = root
+            self.add_relationship("word/document.xml", REL_TYPE + kind, f"{kind}.xml")
+            self.add_override(part_name, PART_CONTENT_TYPES[kind])
+        return self.load(part_name)
+
+    def save(self, output: Path) -> None:
+        for part_name, root in self.xml.items():
+            if part_name.endswith(".rels") and len(root) == 0 and part_name not in self.parts:
+                continue
+            self.parts[part_name] = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr("[Content_Types].xml", self.parts["[Content_Types].xml"])
+                for name, data in self.parts.items():
+                    if name != "[Content_Types].xml":
+                        # 图片本身已压缩，原样存入省去一遍 deflate
+                        compress_type = zipfile.ZIP_STORED if name.startswith("word/media/") else None
+                        z.writestr(name, data, compress_type=compress_type)
+            os.replace(tmp_path, output)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+def content_type(types: etree._Element, part_name: str) -> str:
+    """按 [Content_Types].xml 查部件类型：先找 Override，再按扩展名找 Default。"""
+    for override in types.iter(f"{{{CT_NS}}}Override"):
+        if override.get("PartName") == f"/{part_name}":
+            return override.get("ContentType")
+    extension = posixpath.splitext(part_name)[1].lstrip(".").lower()
+    for default in types.iter(f"{{{CT_NS}}}Default"):
+        if default.get("Extension").lower() == extension:
+            return default.get("ContentType")
+    return "application/octet-stream"
+
+
+def remap_relationships(
+    merged: MergedDocx, fragment: dict[str, bytes], part_name: str, elements: list[etree._Element]
+) -> None:
+    """把片段中 part_name 所引用的关系（图片、超链接等）复制到基底，并改写 r:* 属性。"""
+    frag_rels = {
+        rel.get("Id"): rel
+        for rel in parse(fragment.get(rels_name(part_name), b"<Relationships/>")).iter(f"{{{REL_NS}}}Relationship")
+    }
+    frag_types = parse(fragment["[Content_Types].xml"])
+    rel_map: dict[str, str] = {}
+
+    for root in elements:
+        for el in root.iter():
+            for attr, value in el.attrib.items():
+                if not attr.startswith(f"{{{R_NS}}}") or value not in frag_rels:
+                    continue
+                if value not in rel_map:
+                    rel = frag_rels[value]
+                    rel_type, target = rel.get("Type"), rel.get("Target")
+                    if rel.get("TargetMode") == "External":
+                        rel_map[value] = merged.add_relationship(part_name, rel_type, target, external=True)
+                    elif rel_type == REL_TYPE + "image":
+                        source_name = posixpath.normpath(posixpath.join(posixpath.dirname(part_name), target))
+                        data = fragment[source_name]
+                        digest = hashlib.sha256(data).hexdigest()
+                        extension = posixpath.splitext(source_name)[1].lstrip(".")
+                        media_name = merged.media.get(digest)
+                        if media_name is None:
+                            media_name = f"word/media/{digest[:20]}.{extension}"
+                            merged.parts[media_name] = data
+                            merged.media[digest] = media_name
+                            merged.add_override(media_name, content_type(frag_types, source_name))
+                        relative = posixpath.relpath(media_name, posixpath.dirname(part_name))
+                        rel_map[value] = merged.add_relationship(part_name, rel_type, relative)
+                    else:
+                        rel_map[value] = merged.add_relationship(part_name, rel_type, target)
+                el.set(attr, rel_map[value])
+
+
+def merge_numbering(merged: MergedDocx, fragment: dict[str, bytes], elements: list[etree._Element]) -> None:
+    if "word/numbering.xml" not in fragment:
+        return
+    numbering = merged.ensure_part("numbering", fragment)
+    frag_numbering = parse(fragment["word/numbering.xml"])
+
+    existing_abstract = {el.get(w("abstractNumId")) for el in numbering.iter(w("abstractNum"))}
+    first_num = numbering.find(w("num"))
+    for abstract in frag_numbering.iter(w("abstractNum")):
+        # pandoc 按列表样式生成固定的 abstractNumId，同号即同一定义。
+        if abstract.get(w("abstractNumId")) in existing_abstract:
+            continue
+        if first_num is not None:
+            first_num.addprevious(abstract)
+        else:
+            numbering.append(abstract)
+        existing_abstract.add(abstract.get(w("abstractNumId")))
+
+    num_map: dict[str, str] = {}
+    last_num = list(numbering.iter(w("num")))
+    anchor = last_num[-1] if last_num else None
+    for num in list(frag_numbering.iter(w("num"))):
+        new_id = str(merged.next_num_id)
+        merged.next_num_id += 1
+        num_map[num.get(w("numId"))] = new_id
+        num.set(w("numId"), new_id)
+        if anchor is not None:
+            anchor.addnext(num)
+        else:
+            numbering.append(num)
+        anchor = num
+
+    for root in elements:
+        for el in root.iter(w("numId")):
+            value = el.get(w("val"))
+            if value in num_map:
+                el.set(w("val"), num_map[value])
+
+
+def merge_styles(merged: MergedDocx, fragment: dict[str, bytes]) -> None:
+    if fragment["word/styles.xml"] == merged.parts["word/styles.xml"]:
+        return  # 同一模板生成的片段，不必逐个比对样式
+    styles = merged.load("word/styles.xml")
+    existing = {el.get(w("styleId")) for el in styles.iter(w("style"))}
+    for style in parse(fragment["word/styles.xml"]).iter(w("style")):
+        if style.get(w("styleId")) not in existing:
+            styles.append(style)
+            existing.add(style.get(w("styleId")))
+
+
+def merge_footnotes(merged: MergedDocx, fragment: dict[str, bytes], elements: list[etree._Element]) -> None:
+    if "word/footnotes.xml" not in fragment:
+        return
+    notes = [
+        note for note in parse(fragment["word/footnotes.xml"]).iter(w("footnote")) if note.get(w("type")) is None
+    ]
+    if not notes:
+        return
+    footnotes = merged.ensure_part("footnotes", fragment)
+    remap_relationships(merged, fragment, "word/footnotes.xml", notes)
+    renumber_unique_ids(merged, notes)
+
+    note_map: dict[str, str] = {}
+    for note in notes:
+        new_id = str(merged.next_footnote_id)
+        merged.next_footnote_id += 1
+        note_map[note.get(w("id"))] = new_id
+        note.set(w("id"), new_id)
+        footnotes.append(note)
+    for root in elements:
+        for el in root.iter(w("footnoteReference")):
+            value = el.get(w("id"))
+            if value in note_map:
+                el.set(w("id"), note_map[value])
+
+
+def renumber_unique_ids(merged: MergedDocx, elements: list[etree._Element]) -> None:
+    """书签 id/名称与图片 docPr id 在整个文档中必须唯一。"""
+    bookmark_ids: dict[str, str] = {}
+    bookmark_names: dict[str, str] = {}
+    for root in elements:
+        for el in root.iter(w("bookmarkStart"), w("bookmarkEnd")):
+            old_id = el.get(w("id"))
+            if old_id not in bookmark_ids:
+                bookmark_ids[old_id] = str(merged.next_bookmark_id)
+                merged.next_bookmark_id += 1
+            el.set(w("id"), bookmark_ids[old_id])
+            if el.tag != w("bookmarkStart"):
+                continue
+            name = el.get(w("name"))
+            new_name, suffix = name, 1
+            while new_name in merged.bookmark_names:
+                new_name = f"{name}-{suffix}"
+                suffix += 1
+            merged.bookmark_names.add(new_name)
+            bookmark_names[name] = new_name
+            el.set(w("name"), new_name)
+        for el in root.iter(f"{{{WP_NS}}}docPr", f"{{{PIC_NS}}}cNvPr"):
+            el.set("id", str(merged.next_docpr_id))
+            merged.next_docpr_id += 1
+
+    for root in elements:
+        for el in root.iter(w("hyperlink")):
+            anchor = el.get(w("anchor"))
+            if anchor in bookmark_names:
+                el.set(w("anchor"), bookmark_names[anchor])
+
+
+def page_break_paragraph() -> etree._Element:
+    p = etree.Element(w("p"))
+    etree.SubElement(etree.SubElement(p, w("r")), w("br")).set(w("type"), "page")
+    return p
+
+
+def merge_docx(fragments: list[Path], output: Path, page_breaks: bool = False) -> None:
+    """按顺序合并 fragments，写出到 output（原子替换）。
+
+    page_breaks 为 True 时在每个后续片段之前插入一个分页段落。
+    """
+    merged = MergedDocx(read_package(fragments[0]))
+
+    for path in fragments[1:]:
+        fragment = read_package(path)
+        body = parse(fragment["word/document.xml"]).find(w("body"))
+        elements = [el for el in body if el.tag != w("sectPr")]
+        if page_breaks:
+            elements.insert(0, page_break_paragraph())
+
+        remap_relationships(merged, fragment, "word/document.xml", elements)
+        merge_numbering(merged, fragment, elements)
+        merge_styles(merged, fragment)
+        merge_footnotes(merged, fragment, elements)
+        renumber_unique_ids(merged, elements)
+
+        for el in elements:
+            if merged.sect_pr is not None:
+                merged.sect_pr.addprevious(el)
+            else:
+                merged.body.append(el)
+
+    merged.save(output)
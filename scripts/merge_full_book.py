@@ -2,11 +2,22 @@
 # -*- coding: utf-8 -*-
 """将全书合并为单一 Markdown，统一标题层级与注释格式。"""
 
+import argparse
+import hashlib
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-MANUSCRIPT_DIR = Path(__file__).resolve().parent.parent / "manuscript"
+from file_utils import write_text_atomic, write_text_if_changed
+
+ROOT = Path(__file__).resolve().parent.parent
+MANUSCRIPT_DIR = ROOT / "manuscript"
 OUTPUT_FILE = MANUSCRIPT_DIR / "full-book.md"
+CACHE_DIR = ROOT / ".cache" / "merge_full_book"
+
+# 章节变换版本号：修改 adjust_headings_* / normalize_notes 的输出时必须递增，使旧缓存失效。
+TRANSFORM_VERSION = "1"
 
 # 篇名：在该章前插入（仅当为新篇时），与「前言」同级，用 ##
 PARTS = {
@@ -33,66 +44,93 @@ def adjust_headings_preface(text: str) -> str:
     return "\n".join(out)
 
 
-def adjust_headings_chapter(text: str) -> str:
-    """章节：从最深到最浅替换，避免重复。# → ###，## → ####，### → #####，#### → ######"""
-    # 从最深层级开始替换（#### → ######，### → #####，## → ####，# 第X章 → ###）
-    text = re.sub(r"^(#### )(.+)$", r"###### \2", text, flags=re.MULTILINE)
-    text = re.sub(r"^(### )(.+)$", r"##### \2", text, flags=re.MULTILINE)
-    text = re.sub(r"^(## )(.+)$", r"#### \2", text, flags=re.MULTILINE)
-    text = re.sub(r"^(# )(第[0-9]+章 .+)$", r"### \2", text, flags=re.MULTILINE)
-    return text
-
-
-def normalize_notes(text: str) -> str:
-    """统一导出更稳定的 Markdown 结构。"""
-    lines = text.split("\n")
+# 行分类标记：每行只分类一次，标题平移与补空行规则共用同一结果。
+BLANK = 1
+HEADING = 2  # 章节内需要下移两级的标题（# 第N章 …、##、###、####）
+IMAGE = 4
+TABLE = 8
+LIST = 16
+BOLD_LINE = 32  # 独立成行的 **粗体**
+BOLD_START = 64  # 以 ** 开头的行
+QUOTE_EXAMPLE = 128  # 引用块里的 Step / 🎯 / 拆解结果 示例行
+QUOTE_TABLE = 256  # 引用块里的表格行
+
+IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]+\)")
+ORDERED_LIST_RE = re.compile(r"\d+\.\s")
+CHAPTER_TITLE_RE = re.compile(r"第[0-9]+章 .+")
+LIST_PREFIXES = ("* ", "*\t", "- ", "+ ")
+QUOTE_EXAMPLE_PREFIXES = ("> Step ", "> 🎯 ", "> 拆解结果：")
+
+
+def classify_line(line: str) -> int:
+    """返回该行的分类标记（按位或）。"""
+    stripped = line.strip()
+    if not stripped:
+        return BLANK
+
+    tag = 0
+    if line[0] == "#":
+        level = len(line) - len(line.lstrip("#"))
+        if 1 <= level <= 4 and line[level : level + 1] == " " and len(line) > level + 1:
+            if level > 1 or CHAPTER_TITLE_RE.fullmatch(line, 2):
+                tag |= HEADING
+        return tag
+
+    if line[0] == ">":
+        if line.startswith(QUOTE_EXAMPLE_PREFIXES):
+            tag |= QUOTE_EXAMPLE
+        elif line.startswith("> |"):
+            tag |= QUOTE_TABLE
+
+    lead = line.lstrip()
+    first = lead[0]
+    if first == "|":
+        tag |= TABLE
+    elif first == "!":
+        if IMAGE_RE.fullmatch(stripped):
+            tag |= IMAGE
+    elif first == "*":
+        if lead.startswith("**"):
+            tag |= BOLD_START
+            if len(stripped) >= 5 and stripped.endswith("**"):
+                tag |= BOLD_LINE
+        elif lead.startswith(LIST_PREFIXES):
+            tag |= LIST
+    elif lead.startswith(LIST_PREFIXES) or ORDERED_LIST_RE.match(lead):
+        tag |= LIST
+    return tag
+
+
+def strip_quote_prefix(line: str) -> str:
+    if line.startswith("> "):
+        return line[2:]
+    if line == ">":
+        return ""
+    return line
+
+
+def normalize_lines(lines: list[str], tags: list[int], shift_headings: bool = False) -> str:
+    """按分类结果一次扫描完成标题下移（可选）与补空行。"""
     out: list[str] = []
-
-    def is_image(line: str) -> bool:
-        return bool(re.match(r"^!\[[^\]]*\]\([^)]+\)$", line.strip()))
-
-    def is_standalone_bold(line: str) -> bool:
-        return bool(re.match(r"^\*\*.+\*\*$", line.strip()))
-
-    def starts_bold_text(line: str) -> bool:
-        return line.lstrip().startswith("**")
-
-    def starts_table(line: str) -> bool:
-        return line.lstrip().startswith("|")
-
-    def starts_list(line: str) -> bool:
-        stripped = line.lstrip()
-        return stripped.startswith(("* ", "*\t", "- ", "+ ")) or bool(re.match(r"^\d+\.\s", stripped))
-
-    def strip_quote_prefix(line: str) -> str:
-        if line.startswith("> "):
-            return line[2:]
-        if line == ">":
-            return ""
-        return line
-
-    def is_quote_table_row(line: str) -> bool:
-        return line.startswith("> |")
-
-    def is_quote_example_line(line: str) -> bool:
-        return line.startswith("> Step ") or line.startswith("> 🎯 ") or line.startswith("> 拆解结果：")
+    n = len(lines)
 
     i = 0
-    while i < len(lines):
+    while i < n:
         line = lines[i]
+        tag = tags[i]
 
         # 把“引用块里的步骤 + 表格”改写成普通段落/表格，保证 Word 能识别表格。
-        if is_quote_example_line(line):
+        if tag & QUOTE_EXAMPLE:
             out.append(strip_quote_prefix(line))
             i += 1
             first_table_row = True
-            while i < len(lines):
+            while i < n:
                 current = lines[i]
                 if current == ">":
                     out.append("")
                     i += 1
                     continue
-                if is_quote_table_row(current):
+                if tags[i] & QUOTE_TABLE:
                     if first_table_row and out and out[-1] != "":
                         out.append("")
                     out.append(strip_quote_prefix(current))
@@ -106,63 +144,155 @@ def normalize_notes(text: str) -> str:
                 break
             continue
 
+        if shift_headings and tag & HEADING:
+            # # 第X章 → ###，## → ####，### → #####，#### → ######
+            line = "##" + line
         out.append(line)
-        next_line = lines[i + 1] if i + 1 < len(lines) else None
-        if next_line is None:
+        if i + 1 >= n:
             break
-        if next_line.strip() == "":
+        next_tag = tags[i + 1]
+        if next_tag & BLANK:
             i += 1
             continue
 
         # 普通段落后如果接列表或表格，补空行，让 Word 不把它们黏在一起。
-        if line.strip() and not starts_list(line) and not starts_table(line) and not is_image(line) and (starts_list(next_line) or starts_table(next_line)):
+        if not tag & (BLANK | LIST | TABLE | IMAGE) and next_tag & (LIST | TABLE):
             out.append("")
             i += 1
             continue
 
         # 图片后紧跟表格/列表时，给 pandoc 一行缓冲，避免导出成乱码或粘连。
-        if is_image(line) and (starts_table(next_line) or starts_list(next_line)):
+        if tag & IMAGE and next_tag & (TABLE | LIST):
             out.append("")
             i += 1
             continue
 
         # 独立粗体提示语后紧跟表格/列表/另一段粗体时，补空行，避免 Word 中粘连。
-        if is_standalone_bold(line) and (starts_table(next_line) or starts_list(next_line) or starts_bold_text(next_line)):
+        if tag & BOLD_LINE and next_tag & (TABLE | LIST | BOLD_START):
             out.append("")
         i += 1
 
     return "\n".join(out)
 
 
-def main():
-    parts: list[str] = []
-    parts.append(f"# {BOOK_TITLE}\n")
+def adjust_headings_chapter(text: str) -> str:
+    """章节：# 第X章 → ###，## → ####，### → #####，#### → ######"""
+    lines = text.split("\n")
+    return "\n".join("##" + line if classify_line(line) & HEADING else line for line in lines)
+
+
+def normalize_notes(text: str) -> str:
+    """统一导出更稳定的 Markdown 结构。"""
+    lines = text.split("\n")
+    return normalize_lines(lines, [classify_line(line) for line in lines])
+
+
+def transform_chapter(index: int, text: str) -> str:
+    """对单章原文做标题层级与注释格式变换（前言与正文章节规则不同）。"""
+    if index == 0:
+        return adjust_headings_preface(text)
+    lines = text.split("\n")
+    return normalize_lines(lines, [classify_line(line) for line in lines], shift_headings=True)
+
+
+def chapter_cache_key(index: int, raw: bytes) -> str:
+    """缓存键：变换版本 + 变换类型 + 原文内容哈希。"""
+    kind = "preface" if index == 0 else "chapter"
+    digest = hashlib.sha256()
+    digest.update(f"{TRANSFORM_VERSION}:{kind}:".encode("utf-8"))
+    digest.update(raw)
+    return digest.hexdigest()
+
+
+def load_transformed(index: int, path: Path, use_cache: bool = True) -> tuple[str, bool]:
+    """读取并变换一章；命中缓存时直接复用变换结果。返回 (文本, 是否命中)。"""
+    raw = path.read_bytes()
+    if not use_cache:
+        return transform_chapter(index, raw.decode("utf-8")), False
+
+    cache_file = CACHE_DIR / f"{chapter_cache_key(index, raw)}.md"
+    if cache_file.exists():
+        return cache_file.read_text(encoding="utf-8"), True
+
+    text = transform_chapter(index, raw.decode("utf-8"))
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    write_text_atomic(cache_file, text)
+    return text, False
 
+
+def chapter_files() -> list[tuple[int, Path]]:
+    """按顺序列出存在的前言与各章文件。"""
+    files: list[tuple[int, Path]] = []
     for i in range(0, 14):
         if i == 0:
             fname = MANUSCRIPT_DIR / "00-前言.md"
         else:
             fname = MANUSCRIPT_DIR / f"{i:02d}-第{i:02d}章.md"
-        if not fname.exists():
-            continue
-        text = fname.read_text(encoding="utf-8")
+        if fname.exists():
+            files.append((i, fname))
+    return files
+
+
+def _load_transformed_job(job: tuple[int, Path, bool]) -> tuple[str, bool]:
+    index, path, use_cache = job
+    return load_transformed(index, path, use_cache=use_cache)
 
-        if i == 0:
-            text = adjust_headings_preface(text)
-            parts.append(text)
-            parts.append("\n\n---\n\n")
-            continue
 
+def transform_chapters(
+    files: list[tuple[int, Path]], use_cache: bool = True, jobs: int = 1
+) -> list[tuple[str, bool]]:
+    """变换各章，返回与 files 同序的 (文本, 是否命中缓存)。jobs > 1 时在进程池中并行处理。"""
+    work = [(i, path, use_cache) for i, path in files]
+    if jobs <= 1 or len(work) <= 1:
+        return [_load_transformed_job(job) for job in work]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+        # map 按提交顺序返回结果，拼接顺序与章节顺序一致。
+        return list(pool.map(_load_transformed_job, work))
+
+
+def build_segments(use_cache: bool = True, report: bool = False, jobs: int = 1) -> list[str]:
+    """按章返回全书片段：书名 + 前言为第一段，其后每章一段（含篇名与章末分隔线）。
+
+    各段直接拼接即为 full-book.md 的全文。
+    """
+    segments: list[str] = [f"# {BOOK_TITLE}\n"]
+
+    files = chapter_files()
+    for (i, fname), (text, hit) in zip(files, transform_chapters(files, use_cache=use_cache, jobs=jobs)):
+        if report:
+            print(f"{'缓存命中' if hit else '重新处理'}：{fname.name}")
+
+        parts: list[str] = []
         if i in PARTS:
             parts.append(PARTS[i] + "\n\n")
-        text = adjust_headings_chapter(text)
-        text = normalize_notes(text)
         parts.append(text)
         parts.append("\n\n---\n\n")
+        if i == 0:
+            segments[0] += "".join(parts)
+        else:
+            segments.append("".join(parts))
+
+    segments[-1] = segments[-1].rstrip() + "\n"
+    return segments
+
+
+def build_full_book(use_cache: bool = True, report: bool = False, jobs: int = 1) -> str:
+    return "".join(build_segments(use_cache=use_cache, report=report, jobs=jobs))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="合并分章稿为 full-book.md")
+    parser.add_argument("--no-cache", action="store_true", help="不使用章节缓存，全部重新处理")
+    parser.add_argument("--report", action="store_true", help="列出各章缓存命中/未命中情况")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="并行处理的进程数，0 表示使用全部 CPU 核心")
+    args = parser.parse_args(argv)
 
-    out_text = "".join(parts).rstrip() + "\n"
-    OUTPUT_FILE.write_text(out_text, encoding="utf-8")
-    print(f"已生成：{OUTPUT_FILE}")
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    out_text = build_full_book(use_cache=not args.no_cache, report=args.report, jobs=jobs)
+    if write_text_if_changed(OUTPUT_FILE, out_text):
+        print(f"已生成：{OUTPUT_FILE}")
+    else:
+        print(f"内容未变化：{OUTPUT_FILE}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Gemini and OpenAI image APIs.
+
+Serves just enough of both APIs for image_providers.py, list_models.py,
+list_proxy_models.py and batch_generate_images.py to run with no network:
+
+- GET  /v1beta/models                          Gemini model list
+- POST /v1beta/models/<model>:generateContent  Gemini image (inline base64)
+- GET  /v1/models                              OpenAI model list
+- POST /v1/images/generations                  OpenAI image (url or b64_json)
+- GET  /files/<id>.png                         image downloads for url responses
+
+Latency, error rate, a requests-per-second limit (HTTP 429 above it) and the
+size of the returned PNG are configurable. Point the clients at it with the
+environment variables printed on start-up, e.g. to benchmark batch runs:
+
+    python scripts/mock_image_server.py --latency 1.5 --error-rate 0.1 --rate-limit 5
+    GOOGLE_API_KEY=mock GOOGLE_GEMINI_BASE_URL=http://127.0.0.1:8765 \\
+        python scripts/batch_generate_images.py -o /tmp/mock-images --force -j 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import collections
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GEMINI_MODELS = ["gemini-3-pro-image-preview", "gemini-2.5-flash-image", "gemini-2.5-flash"]
+OPENAI_MODELS = ["dall-e-3", "gpt-image-1", "flux-schnell", "claude-sonnet-4", "deepseek-chat"]
+
+GENERATE_RE = re.compile(r"^/v1beta/models/([^/:]+):generateContent$")
+FILE_RE = re.compile(r"^/files/([0-9a-f]{32})\.png$")
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def make_png(size: int, width: int = 64, height: int = 36) -> bytes:
+    """A valid width x height PNG padded to about size bytes with an ancillary chunk."""
+    row = b"\x00" + bytes((254, 252, 232)) * width
+    head = b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+    body = png_chunk(b"IDAT", zlib.compress(row * height))
+    tail = png_chunk(b"IEND", b"")
+    padding = size - len(head) - len(body) - len(tail) - 12
+    if padding > 0:
+        # Lower-case first letter: ancillary, so decoders skip it.
+        body += png_chunk(b"mkPd", b"\x00" * padding)
+    return head + body + tail
+
+
+class MockState:
+    def __init__(self, latency=0.5, jitter=0.5, error_rate=0.0, rate_limit=0.0, payload_size=200_000, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.image = make_png(payload_size)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = collections.deque()
+        self.files: dict[str, bytes] = {}
+        self.stats = collections.Counter()
+
+    def admit(self) -> int | None:
+        """Return an HTTP error status for this request, or None to serve it."""
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if self.rate_limit > 0:
+                while self.recent and now - self.recent[0] > 1.0:
+                    self.recent.popleft()
+                if len(self.recent) >= self.rate_limit:
+                    self.stats["429"] += 1
+                    return 429
+                self.recent.append(now)
+            if self.random.random() < self.error_rate:
+                status = self.random.choice((500, 503))
+                self.stats[str(status)] += 1
+                return status
+            delay = self.latency * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(max(0.0, delay))
+        with self.lock:
+            self.stats["200"] += 1
+        return None
+
+    def store(self) -> str:
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = self.image
+        return file_id
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload: dict, status: int = 200) -> None:
+        self.send_bytes(json.dumps(payload).encode("utf-8"), "application/json", status)
+
+    def send_bytes(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int) -> None:
+        message = "rate limit exceeded" if status == 429 else "mock server error"
+        self.send_json({"error": {"code": status, "message": message, "status": "UNAVAILABLE"}}, status)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/v1beta/models":
+            self.send_json({
+                "models": [
+                    {"name": f"models/{name}", "supportedActions": ["generateContent"]} for name in GEMINI_MODELS
+                ]
+            })
+        elif path == "/v1/models":
+            self.send_json({
+                "object": "list",
+                "data": [{"id": name, "object": "model", "created": 0, "owned_by": "mock"} for name in OPENAI_MODELS],
+            })
+        elif FILE_RE.match(path):
+            with self.server.state.lock:
+                body = self.server.state.files.pop(FILE_RE.match(path).group(1), None)
+            if body is None:
+                self.send_error_json(404)
+            else:
+                self.send_bytes(body, "image/png")
+        else:
+            self.send_error_json(404)
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        request = self.read_json()
+        state = self.server.state
+        match = GENERATE_RE.match(path)
+        if match is None and path != "/v1/images/generations":
+            self.send_error_json(404)
+            return
+
+        status = state.admit()
+        if status is not None:
+            self.send_error_json(status)
+            return
+
+        if match is not None:
+            self.send_json({
+                "candidates": [{
+                    "content": {
+                        "role": "model",
+                        "parts": [{"inlineData": {"mimeType": "image/png", "data": base64.b64encode(state.image).decode("ascii")}}],
+                    },
+                    "finishReason": "STOP",
+                }],
+                "modelVersion": match.group(1),
+            })
+        elif request.get("response_format") == "b64_json":
+            self.send_json({"created": int(time.time()), "data": [{"b64_json": base64.b64encode(state.image).decode("ascii")}]})
+        else:
+            host = self.headers.get("Host") or f"127.0.0.1:{self.server.server_port}"
+            url = f"http://{host}/files/{state.store()}.png"
+            self.send_json({"created": int(time.time()), "data": [{"url": url, "revised_prompt": request.get("prompt")}]})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, state: MockState, verbose: bool = False):
+        super().__init__(address, MockHandler)
+        self.state = state
+        self.verbose = verbose
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, verbose: bool = False, **options) -> MockServer:
+    """Start a mock server in a background thread; port 0 picks a free port."""
+    server = MockServer((host, port), MockState(**options), verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def client_env(server: MockServer) -> dict[str, str]:
+    base = f"http://{server.server_address[0]}:{server.server_port}"
+    return {
+        "GOOGLE_API_KEY": "mock",
+        "GOOGLE_GEMINI_BASE_URL": base,
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"{base}/v1",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Gemini/OpenAI image API for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean generation latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Latency varies by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of generations answered with 500/503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Generations per second before 429 (0 = unlimited)")
+    parser.add_argument("--payload-size", type=int, default=200_000, help="Approximate size of returned PNGs in bytes")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = start_server(
+        args.host, args.port, args.verbose,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, payload_size=args.payload_size, seed=args.seed,
+    )
+    print(f"Mock image API on http://{args.host}:{server.server_port}")
+    for key, value in client_env(server).items():
+        print(f"  export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print("Requests:", dict(server.state.stats))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""On-disk model catalog for the image providers.
+
+Listing models means downloading a proxy's entire model list, so each
+provider/base-URL pair keeps a copy in .cache/models/ for CATALOG_TTL
+seconds. The copy also stores the keyword categories, which are computed once
+per refresh. A lookup of an unknown model triggers a refresh of a copy older
+than MISS_REFRESH_AGE, so a newly added model is picked up without waiting for
+the TTL.
+
+The generation scripts call validate_model() so a mistyped --model fails
+before an expensive request is sent.
+"""
+
+from __future__ import annotations
+
+import difflib
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import image_providers
+from file_utils import write_text_atomic
+from image_providers import ProviderError
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = ROOT / ".cache" / "models"
+CATALOG_TTL = int(os.environ.get("MODEL_CATALOG_TTL", 24 * 3600))
+MISS_REFRESH_AGE = 300
+
+# Categorize for better display; first matching keyword wins.
+CATEGORIES = {
+    "GPT (OpenAI)": ["gpt", "dall-e", "o1"],
+    "Claude (Anthropic)": ["claude"],
+    "Gemini (Google)": ["gemini"],
+    "DeepSeek": ["deepseek"],
+    "Midjourney/Flux": ["mj", "flux", "midjourney"],
+    "Other": [],
+}
+
+
+def model_key(model_id: str) -> str:
+    """Gemini lists models as "models/<id>" but is called with the bare id."""
+    return model_id.lower().removeprefix("models/")
+
+
+def categorize(model_ids: list[str]) -> dict[str, list[str]]:
+    categorized: dict[str, list[str]] = {cat: [] for cat in CATEGORIES}
+    for model_id in model_ids:
+        lowered = model_id.lower()
+        for cat, keywords in CATEGORIES.items():
+            if not keywords or any(k in lowered for k in keywords):
+                categorized[cat].append(model_id)
+                break
+    return categorized
+
+
+def catalog_path(provider) -> Path:
+    digest = hashlib.sha256((provider.base_url or "default").encode("utf-8")).hexdigest()[:12]
+    return CACHE_DIR / f"{provider.name}-{digest}.json"
+
+
+def read_catalog(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def refresh_catalog(provider) -> dict:
+    models = sorted(provider.list_models(), key=lambda model: model["id"])
+    ids = [model["id"] for model in models]
+    catalog = {
+        "provider": provider.name,
+        "base_url": provider.base_url,
+        "fetched_at": time.time(),
+        "models": {model_key(model["id"]): model for model in models},
+        "categories": categorize(ids),
+    }
+    path = catalog_path(provider)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_text_atomic(path, json.dumps(catalog, ensure_ascii=False, indent=2) + "\n")
+    return catalog
+
+
+def catalog_age(catalog: dict) -> float:
+    return time.time() - catalog["fetched_at"]
+
+
+def load_catalog(provider, ttl: float = CATALOG_TTL, refresh: bool = False) -> dict:
+    """Return the cached catalog, downloading it only when missing, expired or refresh is set."""
+    if not refresh:
+        catalog = read_catalog(catalog_path(provider))
+        if catalog is not None and catalog_age(catalog) < ttl:
+            return catalog
+    return refresh_catalog(provider)
+
+
+def lookup(provider, model_id: str, ttl: float = CATALOG_TTL) -> dict | None:
+    """Return the catalog entry for model_id, or None if the provider does not list it."""
+    catalog = load_catalog(provider, ttl)
+    entry = catalog["models"].get(model_key(model_id))
+    if entry is None and catalog_age(catalog) > MISS_REFRESH_AGE:
+        catalog = refresh_catalog(provider)
+        entry = catalog["models"].get(model_key(model_id))
+    return entry
+
+
+def validate_model(provider, model_id: str, ttl: float = CATALOG_TTL) -> None:
+    """Raise ProviderError if model_id is not in the provider's catalog.
+
+    A catalog that cannot be fetched (offline, listing not supported by the
+    proxy) does not block generation; only a definite miss does.
+    """
+    try:
+        if lookup(provider, model_id, ttl) is not None:
+            return
+        catalog = load_catalog(provider, ttl)
+    except ProviderError as e:
+        print(f"Warning: could not check model '{model_id}': {e}")
+        return
+    close = difflib.get_close_matches(model_key(model_id), list(catalog["models"]), n=3, cutoff=0.5)
+    hint = f" Did you mean: {', '.join(close)}?" if close else ""
+    raise ProviderError(f"model '{model_id}' is not offered by {provider.name} ({provider.base_url or 'default'}).{hint}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show or refresh the cached model catalog")
+    parser.add_argument("--provider", "-p", choices=sorted(image_providers.PROVIDERS), default="openai")
+    parser.add_argument("--refresh", action="store_true", help="Download the model list even if the cache is fresh")
+    parser.add_argument("--check", metavar="MODEL", help="Exit non-zero if MODEL is not offered")
+    args = parser.parse_args()
+
+    provider = image_providers.get_provider(args.provider)
+    try:
+        if args.check:
+            validate_model(provider, args.check)
+            print(f"{args.check}: ok")
+        else:
+            catalog = load_catalog(provider, refresh=args.refresh)
+            print(f"{len(catalog['models'])} models, fetched {catalog_age(catalog) / 60:.0f} min ago ({catalog_path(provider)})")
+    except ProviderError as e:
+        raise SystemExit(f"Error: {e}")
@@ -2,27 +2,131 @@
 """
 将 pandoc 生成的 full-pandoc.md 按「前言」「第1章」「第2章」拆分为
 00-前言.md、01-第01章.md、02-第02章.md，并统一为 # / ## 标题格式。
+
+逐行流式处理：每行读入后立即做标题规范化并写入当前章节的临时文件，遇到下一章
+的起始行即收尾上一章，内存占用与 full-pandoc.md 的大小无关（内嵌 base64 图片
+的数百 MB 导出也一样）。
 """
+import hashlib
+import os
 import re
 from pathlib import Path
 
+from file_utils import has_content
+
+FRONT_MATTER_RE = re.compile(r"^\*\*前言\s*\+\s*第")
+PREFACE_RE = re.compile(r"^\*\*前言\s*\*\*\s*$")
+CHAPTER_RE = re.compile(r"^\*\*第\s*(\d+)\s*章\s*(.*)\*\*\s*$")
+BOLD_HEADING_RE = re.compile(r"^\*\*(.+)\*\*\s*$")
+
+
+class HeadingNormalizer:
+    """逐行把 **标题** 转为 # 或 ##：第一个单独成行的 **...** 转为 #，其余转为 ##。"""
+
+    def __init__(self, first_heading_is_h1: bool = True):
+        self.first = first_heading_is_h1
+
+    def __call__(self, line: str) -> str:
+        m = BOLD_HEADING_RE.match(line)
+        if not m:
+            return line
+        title = m.group(1).strip()
+        if self.first:
+            self.first = False
+            return "# " + title
+        return "## " + title
+
+
 def normalize_headings(text: str, first_heading_is_h1: bool = True) -> str:
     """将 **标题** 转为 # 或 ##：第一个单独成行的 **...** 转为 #，其余转为 ##。"""
-    lines = text.split("\n")
-    out = []
-    first = first_heading_is_h1
-    for line in lines:
-        m = re.match(r"^\*\*(.+)\*\*\s*$", line)
-        if m:
-            title = m.group(1).strip()
-            if first:
-                out.append("# " + title)
-                first = False
+    normalize = HeadingNormalizer(first_heading_is_h1)
+    return "\n".join(normalize(line) for line in text.split("\n"))
+
+
+class ChapterWriter:
+    """把一章逐行写入临时文件，同时计算大小与哈希；内容与现有文件相同则不替换。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        self.file = open(self.tmp_path, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.started = False
+        self.normalize = HeadingNormalizer(first_heading_is_h1=True)
+
+    def write_line(self, line: str) -> None:
+        data = self.normalize(line).encode("utf-8")
+        if self.started:
+            data = b"\n" + data
+        self.started = True
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def close(self) -> bool:
+        """收尾并返回是否写入（内容有变化）。"""
+        self.file.close()
+        try:
+            if has_content(self.path, self.size, self.digest.digest()):
+                return False
+            os.replace(self.tmp_path, self.path)
+            return True
+        finally:
+            self.tmp_path.unlink(missing_ok=True)
+
+    def abort(self) -> None:
+        """放弃本章：关闭并删除临时文件，目标文件保持不变。可重复调用。"""
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+def iter_lines(path: Path):
+    """逐行读取（不含换行符），与 read_text().split("\\n") 的结果一致。"""
+    with open(path, encoding="utf-8") as f:
+        line = ""
+        for line in f:
+            yield line[:-1] if line.endswith("\n") else line
+        if line == "" or line.endswith("\n"):
+            yield ""
+
+
+def split_stream(lines, manuscript_dir: Path):
+    """按 **前言** / **第N章** 边界流式拆分，每章收尾时产出 (文件名, 是否有变化)。
+
+    中途出错或调用方提前停止迭代时，未写完的那一章被放弃（删除临时文件），
+    已收尾的章节不受影响。
+    """
+    writer = None
+    title = None
+    try:
+        for line in lines:
+            if FRONT_MATTER_RE.match(line):
+                continue
+            next_title = None
+            if PREFACE_RE.match(line):
+                next_title = "00-前言"  # 保留 **前言** 行，统一转成 #
             else:
-                out.append("## " + title)
-            continue
-        out.append(line)
-    return "\n".join(out)
+                m = CHAPTER_RE.match(line)
+                if m:
+                    num = m.group(1).zfill(2)
+                    next_title = f"{num}-第{num}章"
+            if next_title is not None:
+                if writer is not None:
+                    finished, writer = writer, None
+                    yield title, finished.close()
+                title = next_title
+                writer = ChapterWriter(manuscript_dir / f"{title}.md")
+            if writer is not None:
+                # 第一个章节边界之前的内容丢弃
+                writer.write_line(line)
+        if writer is not None:
+            finished, writer = writer, None
+            yield title, finished.close()
+    finally:
+        if writer is not None:
+            writer.abort()
+
 
 def main():
     project_root = Path(__file__).resolve().parent.parent
@@ -30,48 +134,17 @@ def main():
     if not full_path.exists():
         print("未找到 manuscript/full-pandoc.md，请先用 pandoc 生成。")
         return 1
-    text = full_path.read_text(encoding="utf-8")
-    lines = text.split("\n")
-
-    # 按 **第1章 / **第2章 拆分（**前言** 单独作为前言起始）
-    chunks = []  # (title, start_line, end_line) 或 (title, lines)
-    current = []
-    current_title = None
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if re.match(r"^\*\*前言\s*\+\s*第", line):
-            i += 1
-            continue
-        if re.match(r"^\*\*前言\s*\*\*\s*$", line):
-            if current and current_title:
-                chunks.append((current_title, current))
-            current_title = "00-前言"
-            current = [line]  # 保留 **前言** 行，后面统一转成 #
-            i += 1
-            continue
-        m = re.match(r"^\*\*第\s*(\d+)\s*章\s*(.*)\*\*\s*$", line)
-        if m:
-            if current and current_title:
-                chunks.append((current_title, current))
-            num = m.group(1).zfill(2)
-            current_title = f"{num}-第{num}章"
-            current = [line]
-            i += 1
-            continue
-        if current is not None:
-            current.append(line)
-        i += 1
-    if current and current_title:
-        chunks.append((current_title, current))
 
     manuscript_dir = project_root / "manuscript"
-    for title, block in chunks:
-        raw = "\n".join(block)
-        normalized = normalize_headings(raw, first_heading_is_h1=True)
-        out_path = manuscript_dir / f"{title}.md"
-        out_path.write_text(normalized, encoding="utf-8")
-        print("已写入:", out_path)
+    changed, unchanged = [], []
+    for title, written in split_stream(iter_lines(full_path), manuscript_dir):
+        if written:
+            changed.append(title)
+            print("已写入:", manuscript_dir / f"{title}.md")
+        else:
+            unchanged.append(title)
+    print(f"共 {len(changed) + len(unchanged)} 个文件：{len(changed)} 个有变化，{len(unchanged)} 个未变化"
+          + (f"（{'、'.join(unchanged)}）" if unchanged else ""))
     return 0
 
 if __name__ == "__main__":